@@ -4,28 +4,39 @@ import uuid
 import threading
 import time
 import json
-from pathlib import Path
+import queue
+import hashlib
+import sqlite3
 import shutil
+import contextlib
+import argparse
+import sys
+import mimetypes
+from pathlib import Path
+import multiprocessing
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Flask, request, render_template_string, jsonify, send_from_directory
+from flask import Flask, request, render_template_string, jsonify, send_from_directory, Response, abort
+from werkzeug.security import safe_join
 import cv2
+import numpy as np
 
-# Optional detectors (may not be installed)
+import segment_merge
+import report_io
+
+# Optional PyAV, used to decode only keyframes in 'keyframe' sampling mode
 try:
-    from nudenet import NudeDetector
-    detector = NudeDetector()
+    import av
 except Exception:
-    detector = None
+    av = None
 
+# Optional waitress, the WSGI server behind `serve --production`
 try:
-    from ultralytics import YOLO
-    person_detector = YOLO('yolov8n.pt')
+    import waitress
 except Exception:
-    person_detector = None
-
-# Fallback HOG person detector
-hog = cv2.HOGDescriptor()
-hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    waitress = None
 
 # Configuration
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -34,12 +45,393 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_FOLDER, 'thumbs'), exist_ok=True)
 
 SAMPLE_FPS = 2
+# Number of sampled frames sent to the detector in one call
+DETECT_BATCH_SIZE = 8
+# Model instances per process. Each detector batch / body-type call checks one instance out of
+# its pool, so on many-core machines several small sessions can run side by side instead of
+# all jobs sharing one oversubscribed session.
+DETECTOR_POOL_SIZE = 1
+PERSON_POOL_SIZE = 1
+PERSON_MODEL = 'yolov8n.pt'
+# ONNX Runtime settings for every NudeNet session (None = NudeNet's bundled model / ORT's
+# defaults). ORT_INTRA_OP_THREADS = 0 splits the CPUs evenly over the sessions of all scan
+# processes (SCAN_WORKERS with the process engine, or `scan -j`) times the pool size;
+# ORT_GRAPH_OPTIMIZATION is one of 'disable', 'basic', 'extended', 'all'.
+NUDENET_MODEL_PATH = None
+ORT_PROVIDERS = None
+ORT_INTRA_OP_THREADS = 0
+ORT_INTER_OP_THREADS = 0
+ORT_GRAPH_OPTIMIZATION = 'all'
+# Models (NudeNet, YOLO/torch, HOG) are imported and built on a background thread, started at
+# server start-up or by the first scan, so the web UI is usable at once; /ready answers 503
+# until they are loaded. MODEL_WARMUP runs them once on a blank frame so the first real scan
+# does not pay for lazy initialisation. PERSON_MODEL = None skips YOLO and uses HOG.
+MODEL_WARMUP = True
+# How frames are read, selectable per upload:
+#   'grab'     decode every frame, keep every step-th one (exact, slowest)
+#   'seek'     jump straight to each sample time (exact, faster when samples are far apart)
+#   'keyframe' decode only I-frames via PyAV (fastest, sample times follow the keyframes)
+SAMPLING_MODES = ('grab', 'seek', 'keyframe')
+SAMPLING_MODE = 'grab'
+# 'full' samples the whole video at SAMPLE_FPS. 'adaptive' first samples at ADAPTIVE_SPARSE_FPS,
+# then rescans ADAPTIVE_WINDOW seconds either side of every hit at ADAPTIVE_DENSE_FPS.
+# 'triage' visits the SAMPLE_FPS frames coarse to fine (spread over the whole timeline first,
+# then filling the gaps) and stops at the first detection scoring TRIAGE_MIN_SCORE or more
+# (per upload: triage_score); its report is then marked partial.
+SCAN_MODES = ('full', 'adaptive', 'triage')
+SCAN_MODE = 'full'
+TRIAGE_MIN_SCORE = 0.8
+ADAPTIVE_SPARSE_FPS = 1
+ADAPTIVE_DENSE_FPS = 4
+ADAPTIVE_WINDOW = 1.0
+# Frames whose FINGERPRINT_SIZE x FINGERPRINT_SIZE difference hash is within GATE_MAX_DISTANCE
+# bits, and whose 4x4 colour layout is within GATE_MAX_COLOR_DELTA, of the last frame run
+# through the models reuse that frame's results (GATE_MAX_DISTANCE = -1 disables)
+FINGERPRINT_SIZE = 16
+GATE_MAX_DISTANCE = 6
+GATE_MAX_COLOR_DELTA = 12
+# Hit thumbnails are downscaled to THUMB_MAX_WIDTH and written as JPEG (quality 0-100) by a
+# background writer; frames are downscaled before they are queued, and scans block only when
+# THUMB_QUEUE_SIZE of them are waiting to be written
+THUMB_MAX_WIDTH = 480
+THUMB_JPEG_QUALITY = 80
+THUMB_QUEUE_SIZE = 64
+# Next to the report each scan writes <id>_sprite.jpg, the segment thumbnails cropped to
+# SPRITE_TILE_WIDTH x SPRITE_TILE_HEIGHT and tiled SPRITE_COLUMNS wide (the first SPRITE_MAX_TILES),
+# and <id>_heatmap.json, the highest score in every HEATMAP_BIN_SECONDS of the video, so the
+# viewer loads two files instead of one JPEG per segment.
+SPRITE_TILE_WIDTH = 168
+SPRITE_TILE_HEIGHT = 112
+SPRITE_COLUMNS = 10
+SPRITE_MAX_TILES = 500
+HEATMAP_BIN_SECONDS = 1.0
+# Body type (YOLO/HOG) runs once per merged segment on its best frame: 'segment' does it at the
+# end of the scan, 'view' leaves segments 'pending' until the report is first viewed, which
+# queues the classification on a scan worker ahead of waiting scans
+BODY_TYPE_MODE = 'segment'
+# Persistent cache of detector output keyed by frame fingerprint, shared by all videos.
+# Least recently used entries are evicted beyond FRAME_CACHE_MAX_ENTRIES (0 disables the cache),
+# checked after every FRAME_CACHE_EVICT_EVERY entries a process writes rather than on every write.
+# Bump FRAME_CACHE_NAMESPACE when the detector model changes.
+FRAME_CACHE_FILE = os.path.join(UPLOAD_FOLDER, 'frame_cache.db')
+FRAME_CACHE_MAX_ENTRIES = 200000
+FRAME_CACHE_EVICT_EVERY = 1000
+FRAME_CACHE_NAMESPACE = 'nudenet'
+# Scans write a checkpoint (per frame range: the next frame to read and the hits so far) to
+# checkpoints/ next to their report at most every CHECKPOINT_INTERVAL seconds. A job restarted
+# from the persisted queue, or by the next `scan` run, carries on from there (0 disables).
+CHECKPOINT_INTERVAL = 30.0
+# In 'seek' mode, targets at most this many frames ahead are reached by decoding forward
+# instead of seeking, since a seek restarts decoding at the previous keyframe anyway
+SEEK_MIN_GAP = 60
 SCORE_THRESHOLD = 0.5
 DETECT_MAX_WIDTH = 640
+# Detections of the same class closer than this (seconds) are merged into one segment
+MERGE_GAP = 10.0
+# Videos at least SEGMENT_SCAN_MIN_DURATION seconds long are split into this many
+# time ranges that are decoded and scanned in parallel (1 disables splitting)
+SEGMENT_SCAN_WORKERS = 4
+SEGMENT_SCAN_MIN_DURATION = 600.0
+
+# Scan scheduling: at most SCAN_WORKERS videos are scanned at once, the rest wait
+# in a FIFO queue that is mirrored to QUEUE_FILE so it survives a restart.
+SCAN_WORKERS = 2
+QUEUE_FILE = os.path.join(UPLOAD_FOLDER, 'queue.json')
+# 'process' runs scans in a pool of SCAN_WORKERS processes that keep their models loaded,
+# 'thread' runs them inside this process (shares the GIL with Flask)
+SCAN_ENGINE = 'process'
+
+# SQLite index of scanned videos with the per-card summary, so listing pages never parse reports
+LIBRARY_DB = os.path.join(UPLOAD_FOLDER, 'library.db')
+PAGE_SIZE = 48
+# Reports are a JSON header plus a columnar <id>_detections.npz (see report_io.py). The viewer
+# reads the header only; /detections/<id> pages through the detections, at most
+# DETECTIONS_PAGE_MAX per request, keeping the columns of the last DETECTIONS_CACHE_SIZE
+# reports in memory.
+DETECTIONS_PAGE_SIZE = 200
+DETECTIONS_PAGE_MAX = 5000
+DETECTIONS_CACHE_SIZE = 8
+
+# Content hash (SHA-256) of every scanned upload -> video_id, so re-uploads reuse the report.
+# SQLite, as scan processes and `scan -j` workers record hashes at the same time; an index from
+# the older hash_index.json is imported on first use.
+HASH_INDEX_FILE = os.path.join(UPLOAD_FOLDER, 'hash_index.db')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Chunked uploads (/upload/...): once EARLY_SCAN_MIN_BYTES have arrived and the file turns out
+# to be a fast-start (moov before mdat) or fragmented MP4, scanning starts while the rest uploads.
+# The scanner polls for new bytes every STREAM_POLL_INTERVAL seconds and gives up waiting after
+# STREAM_STALL_TIMEOUT seconds without growth.
+EARLY_SCAN_MIN_BYTES = 4 * 1024 * 1024
+STREAM_POLL_INTERVAL = 1.0
+STREAM_STALL_TIMEOUT = 600.0
+
+# Progress push: /events (server-sent events) and /status/<id>?wait= (long-poll) answer when a
+# job changes rather than on a timer. Bursts of updates are coalesced into one message per
+# PROGRESS_MIN_INTERVAL; a long-poll waits at most STATUS_MAX_WAIT seconds, an event stream ends
+# after STATUS_MAX_WAIT seconds (the browser reconnects with Last-Event-ID) and an idle one sends
+# a keep-alive every EVENTS_KEEPALIVE seconds.
+PROGRESS_MIN_INTERVAL = 0.5
+STATUS_MAX_WAIT = 25.0
+EVENTS_KEEPALIVE = 15.0
+
+# `serve` runs the debug server by default; `serve --production` runs waitress with SERVE_THREADS
+# threads (or the threaded Werkzeug server without the debugger when waitress is missing).
+# Scans, job state and the queue live in this one process, so it is threads, not workers.
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 5000
+SERVE_THREADS = 16
+# Every open /events stream or /status?wait= long-poll holds one request thread. At most
+# PUSH_MAX_CONNECTIONS are open at once (None = half of SERVE_THREADS in production mode, no limit
+# on the debug server); beyond that they answer 503 and the page falls back to plain polling.
+PUSH_MAX_CONNECTIONS = None
+# /uploads answers Range and conditional (ETag / Last-Modified) requests. Frame thumbnails are
+# named after their frame and never rewritten, so browsers keep them THUMB_CACHE_MAX_AGE seconds;
+# videos, <id>_best.jpg and <id>_sprite.jpg (rewritten when a video is scanned again) are
+# revalidated every time. Behind nginx, MEDIA_ACCEL_PREFIX (e.g. '/_media/', an internal
+# location aliased to UPLOAD_FOLDER) hands the file itself to nginx via X-Accel-Redirect, which
+# serves it with sendfile and its own Range handling.
+THUMB_CACHE_MAX_AGE = 7 * 24 * 3600
+MEDIA_ACCEL_PREFIX = None
+
+# Batch CLI (`python NudeID.py scan ...`): files picked up when walking directories, and the
+# folder created next to scanned videos for their reports and thumbnails
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.avi', '.webm')
+SIDECAR_DIR = '.nudeid'
+
+# Upper bounds (seconds) of the per-stage timing histograms in reports and on /metrics
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+
+def ort_session_options(ort):
+    """SessionOptions built from the ORT_* settings."""
+    opts = ort.SessionOptions()
+    intra = int(ORT_INTRA_OP_THREADS or 0)
+    sessions = scan_processes() * max(1, int(DETECTOR_POOL_SIZE))
+    if intra <= 0 and sessions > 1:
+        intra = max(1, (os.cpu_count() or 1) // sessions)
+    if intra > 0:
+        opts.intra_op_num_threads = intra
+    if ORT_INTER_OP_THREADS:
+        opts.inter_op_num_threads = int(ORT_INTER_OP_THREADS)
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    levels = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    opts.graph_optimization_level = levels.get(ORT_GRAPH_OPTIMIZATION, levels['all'])
+    return opts
+
+
+# Processes scanning side by side on this machine; set by `scan -j N` in its worker processes
+_scan_processes = None
+
+
+def scan_processes():
+    """How many scan processes share the CPUs, each with its own detector pool."""
+    if _scan_processes is not None:
+        return max(1, int(_scan_processes))
+    return max(1, int(SCAN_WORKERS)) if SCAN_ENGINE == 'process' else 1
+
+
+def new_detector():
+    """A NudeNet detector whose ONNX Runtime session uses the ORT_* settings, or None."""
+    try:
+        from nudenet import NudeDetector
+    except Exception:
+        return None
+    try:
+        import onnxruntime as ort
+    except Exception:
+        ort = None
+    kwargs = {}
+    if NUDENET_MODEL_PATH:
+        kwargs['model_path'] = NUDENET_MODEL_PATH
+    if ORT_PROVIDERS:
+        kwargs['providers'] = ORT_PROVIDERS
+    model_path = NUDENET_MODEL_PATH or os.path.join(os.path.dirname(sys.modules[NudeDetector.__module__].__file__), '320n.onnx')
+    if ort is None or not os.path.exists(model_path):
+        # older NudeNet without a bundled ONNX model
+        return NudeDetector(**kwargs)
+    try:
+        session = ort.InferenceSession(model_path, sess_options=ort_session_options(ort),
+                                       providers=ORT_PROVIDERS or ort.get_available_providers())
+    except Exception:
+        return NudeDetector(**kwargs)
+    # NudeDetector takes no session options and would load the model itself, so set it up
+    # around our session instead of loading the model twice
+    det = NudeDetector.__new__(NudeDetector)
+    inp = session.get_inputs()[0]
+    size = [d for d in inp.shape[2:4] if isinstance(d, int)]
+    det.onnx_session = session
+    det.input_name = inp.name
+    det.input_width = det.input_height = size[0] if size else 320
+    return det
+
+
+def new_person_detector():
+    if not PERSON_MODEL:
+        return None
+    try:
+        from ultralytics import YOLO
+    except Exception:
+        return None
+    return YOLO(PERSON_MODEL)
+
+
+class ModelPool:
+    """Up to `size()` model instances, each lent to one caller at a time.
+
+    Slot 0 is always the module-level instance returned by `primary()`, so it can still be
+    replaced at runtime; the other slots are built with `factory()` the first time every
+    existing instance is busy.
+    """
+
+    def __init__(self, primary, factory, size):
+        self.primary = primary
+        self.factory = factory
+        self.size = size
+        self.cond = threading.Condition()
+        self.idle = []
+        self.slots = 0
+        self.instances = {}
+
+    def _acquire(self):
+        with self.cond:
+            while not self.idle and self.slots >= max(1, int(self.size())):
+                self.cond.wait()
+            if self.idle:
+                slot = self.idle.pop()
+            else:
+                slot = self.slots
+                self.slots += 1
+        if slot == 0:
+            return slot, self.primary()
+        if slot not in self.instances:
+            try:
+                inst = self.factory()
+            except Exception:
+                inst = None
+            # no second instance possible: share the primary one
+            self.instances[slot] = inst if inst is not None else self.primary()
+        return slot, self.instances[slot]
+
+    @contextlib.contextmanager
+    def checkout(self):
+        slot, inst = self._acquire()
+        try:
+            yield inst
+        finally:
+            with self.cond:
+                self.idle.append(slot)
+                self.cond.notify()
+
+
+# Set by load_models(); assign them beforehand to use other models
+detector = None
+person_detector = None
+hog = None
+
+MODELS_READY = threading.Event()
+MODEL_STATE = {'state': 'idle'}
+_model_thread = None
+_model_lock = threading.Lock()
+
+
+def _get_hog():
+    """Fallback HOG person detector, built on first use."""
+    global hog
+    if hog is None:
+        h = cv2.HOGDescriptor()
+        h.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        hog = h
+    return hog
+
+
+def load_models():
+    """Build the detectors that are not set yet, optionally warm them up, and mark them ready."""
+    global detector, person_detector
+    start = time.time()
+    MODEL_STATE.update({'state': 'loading', 'started': start})
+    errors = {}
+    if detector is None:
+        try:
+            detector = new_detector()
+        except Exception as e:
+            errors['detector'] = str(e)
+    if person_detector is None:
+        try:
+            person_detector = new_person_detector()
+        except Exception as e:
+            errors['person_detector'] = str(e)
+    if person_detector is None:
+        try:
+            _get_hog()
+        except Exception as e:
+            errors['hog'] = str(e)
+    if MODEL_WARMUP:
+        try:
+            blank = np.zeros((max(1, DETECT_MAX_WIDTH * 9 // 16), DETECT_MAX_WIDTH, 3), dtype=np.uint8)
+            detect_frames([blank])
+            infer_body_type(blank)
+        except Exception as e:
+            errors['warmup'] = str(e)
+    MODEL_STATE.update({'state': 'ready', 'load_time': round(time.time() - start, 3), 'errors': errors,
+                        'detector': detector is not None, 'person_detector': person_detector is not None})
+    MODELS_READY.set()
+
+
+def start_model_loading():
+    """Start load_models() on a background thread (once per process)."""
+    global _model_thread
+    with _model_lock:
+        if _model_thread is None:
+            _model_thread = threading.Thread(target=load_models, daemon=True)
+            _model_thread.start()
+
+
+def ensure_models():
+    """Block until the models are loaded, starting the load if nobody has yet."""
+    if not MODELS_READY.is_set():
+        start_model_loading()
+        MODELS_READY.wait()
+    return dict(MODEL_STATE)
+
+
+DETECTOR_POOL = ModelPool(lambda: detector, new_detector, lambda: DETECTOR_POOL_SIZE)
+PERSON_POOL = ModelPool(lambda: person_detector, new_person_detector, lambda: PERSON_POOL_SIZE)
 
 # Job tracking
 JOBS = {}
-JOBS_LOCK = threading.Lock()
+JOBS_LOCK = threading.RLock()
+# Notified on every job change; JOB_VERSIONS holds the change counter at each job's last change
+JOBS_CHANGED = threading.Condition(JOBS_LOCK)
+JOB_VERSIONS = {}
+_jobs_version = 0
+
+SCAN_QUEUE = []
+SCAN_QUEUE_COND = threading.Condition()
+_scheduler_started = False
+
+_hash_index_imported = False
+_hash_index_import_lock = threading.Lock()
+
+# In-progress chunked uploads: video_id -> running SHA-256 of the bytes received so far, and
+# video_id -> the lock held while a chunk of that upload is appended. UPLOAD_SESSIONS_LOCK only
+# guards the two dicts, never a network read.
+UPLOAD_SESSIONS = {}
+UPLOAD_LOCKS = {}
+UPLOAD_SESSIONS_LOCK = threading.Lock()
+
+_scan_pool = None
+_scan_pool_lock = threading.Lock()
+# Set inside scan worker processes; job updates are sent through it to the parent's JOBS
+_progress_queue = None
+# Model state reported by the scan processes (process engine), for /ready
+SCAN_MODELS_STATE = None
 
 app = Flask(__name__)
 
@@ -62,6 +454,17 @@ INDEX_HTML = """<!doctype html>
           <div class="hint">Or click to select a file — processed locally on this machine</div>
         </div>
         <div>
+          <select name="sampling" class="btn scan-option" title="Frame sampling">
+            <option value="grab">Accurate</option>
+            <option value="seek">Fast seek</option>
+            <option value="keyframe">Keyframes only</option>
+          </select>
+          <select name="scan" class="btn scan-option" title="Scan strategy">
+            <option value="full">Full scan</option>
+            <option value="adaptive">Adaptive</option>
+            <option value="triage">Triage (stop at first hit)</option>
+          </select>
+          <input type="number" name="triage_score" class="btn scan-option" min="0.05" max="1" step="0.05" placeholder="{{ triage_score }}" style="width:90px" title="Triage: stop at a detection scoring at least this" hidden>
           <button id="uploadBtn" class="btn">Select a file</button>
         </div>
       </div>
@@ -80,7 +483,7 @@ INDEX_HTML = """<!doctype html>
             </div>
             <div class="thumb">
               {% if c.thumb %}
-                <img data-src="{{ url_for('uploaded', filename=c.thumb) }}" src="{{ url_for('uploaded', filename=c.thumb) }}" alt="thumbnail">
+                <img data-src="{{ url_for('uploaded', filename=c.thumb) }}" src="{{ url_for('uploaded', filename=c.thumb) }}" alt="thumbnail" loading="lazy">
                                 <div class="overlay">{{ format_time(c.first_ts) }}</div>
               {% else %}
                 <div class="overlay">SAFE</div>
@@ -99,6 +502,13 @@ INDEX_HTML = """<!doctype html>
         {% endfor %}
       {% endif %}
     </div>
+    {% if pages > 1 %}
+    <div class="pager">
+      {% if page > 1 %}<a class="btn" href="{{ url_for('index', page=page - 1) }}">← Newer</a>{% endif %}
+      <span class="subtitle">Page {{ page }} of {{ pages }} — {{ total }} videos</span>
+      {% if page < pages %}<a class="btn" href="{{ url_for('index', page=page + 1) }}">Older →</a>{% endif %}
+    </div>
+    {% endif %}
   </div>
   <script src="/static/app.js"></script>
 </body>
@@ -117,11 +527,17 @@ RESULT_HTML = """<!doctype html>
   <div class="container">
     <div style="display:flex;align-items:center;justify-content:space-between;margin-bottom:12px">
       <a href="/" class="btn">← Back</a>
-      <div style="color:var(--muted);font-size:13px">Video: <strong>{{ video_name }}</strong> — Duration: {{ "%.1f"|format(duration) }}s</div>
+      <div style="color:var(--muted);font-size:13px">Video: <strong>{{ video_name }}</strong> — Duration: {{ "%.1f"|format(duration) }}s{% if partial %} — <strong>partial</strong> (triage stopped at the first confident hit){% endif %}</div>
     </div>
-    <div class="viewer">
+    <div class="viewer"{% if sprite_file %} style="--sprite:url('{{ url_for('uploaded', filename=sprite_file) }}');--sprite-size:{{ sprite_size }}"{% endif %}>
       <div class="video-col">
-        <video id="player" class="video-player" controls src="{{ url_for('uploaded', filename=video_file) }}"></video>
+        <video id="player" class="video-player" controls preload="metadata" src="{{ url_for('uploaded', filename=video_file) }}"></video>
+        {% if heatmap_file %}
+        <div id="timeline" class="timeline" data-heatmap="{{ url_for('uploaded', filename=heatmap_file) }}" data-duration="{{ duration }}" title="Detection score over time, click to seek">
+          <canvas></canvas><i class="playhead"></i>
+          <div class="seg-thumb sprite timeline-preview" hidden></div>
+        </div>
+        {% endif %}
       </div>
       <div class="side-col">
         <h4 style="margin:6px 0;color:#bfe8ff">Detections</h4>
@@ -129,9 +545,11 @@ RESULT_HTML = """<!doctype html>
           {% if segments and segments|length > 0 %}
             <ul class="segments">
             {% for s in segments %}
-              <li data-ts="{{ "%.2f"|format(s.start) }}" onclick="seekVideo({{ "%.2f"|format(s.start) }})">
-                {% if s.thumbnail %}
-                  <img src="{{ url_for('uploaded', filename=s.thumbnail) }}" alt="thumb" class="seg-thumb">
+              <li data-ts="{{ "%.2f"|format(s.start) }}" data-start="{{ "%.2f"|format(s.start) }}" data-end="{{ "%.2f"|format(s.end) }}"{% if s.best_ts is defined %} data-best="{{ "%.2f"|format(s.best_ts) }}"{% endif %} onclick="seekVideo({{ "%.2f"|format(s.start) }})">
+                {% if s.sprite_pos %}
+                  <div class="seg-thumb sprite" style="background-position:{{ s.sprite_pos }}"></div>
+                {% elif s.thumbnail %}
+                  <img src="{{ url_for('uploaded', filename=s.thumbnail) }}" alt="thumb" class="seg-thumb" loading="lazy">
                 {% else %}
                   <div class="seg-thumb placeholder">no thumb</div>
                 {% endif %}
@@ -153,6 +571,9 @@ RESULT_HTML = """<!doctype html>
               </li>
             {% endfor %}
             </ul>
+            {% if detection_count > results|length %}
+              <div class="muted">First {{ results|length }} of {{ detection_count }} detections.</div>
+            {% endif %}
           {% endif %}
         </div>
       </div>
@@ -176,7 +597,10 @@ WAIT_HTML = """<!doctype html>
         <h3>Processing video — please wait</h3>
         <div id="status">
             <div>Stage: <span id="stage">queued</span></div>
+            <div id="queueRow">Queue position: <span id="queue">—</span></div>
             <div>Progress: <span id="percent">0</span>%</div>
+            <div>Unchanged frames skipped: <span id="skipped">0</span></div>
+            <div>Frames answered from cache: <span id="cached">0</span></div>
             <div>ETA: <span id="eta">—</span></div>
             <div id="error" style="color:#f88;margin-top:8px"></div>
         </div>
@@ -184,30 +608,57 @@ WAIT_HTML = """<!doctype html>
     </div>
     <script>
         const jobId = '{{ job_id }}';
+        let version = 0, finished = false;
+        function render(s) {
+            document.getElementById('stage').textContent = s.stage || s.state || 'processing';
+            document.getElementById('queueRow').style.display = s.queue_position ? '' : 'none';
+            document.getElementById('queue').textContent = s.queue_position || '—';
+            document.getElementById('percent').textContent = (s.percent||0).toFixed ? (s.percent||0).toFixed(1) : (s.percent||0);
+            document.getElementById('skipped').textContent = s.frames_skipped || 0;
+            document.getElementById('cached').textContent = s.frames_cached || 0;
+            document.getElementById('eta').textContent = s.eta_readable || (s.eta? Math.floor(s.eta)+'s' : '—');
+            if (s.state === 'done') {
+                // reload the viewer which should now find the report
+                finished = true;
+                location.reload();
+            } else if (s.state === 'error') {
+                finished = true;
+                document.getElementById('error').textContent = 'Error: ' + (s.error || 'unknown');
+            }
+        }
+        // long-poll fallback: the server answers as soon as the job changes, or with 503 when it
+        // has no thread to spare, after which this page polls plainly
+        let waitFor = 25;
         async function poll() {
             try {
-                const res = await fetch('/status/' + jobId);
+                const res = await fetch('/status/' + jobId + (waitFor ? '?wait=' + waitFor + '&since=' + version : ''));
+                if (res.status === 503) { waitFor = 0; setTimeout(poll, 0); return; }
                 const j = await res.json();
                 if (!j.ok) return;
-                const s = j.status || {};
-                document.getElementById('stage').textContent = s.stage || s.state || 'processing';
-                document.getElementById('percent').textContent = (s.percent||0).toFixed ? (s.percent||0).toFixed(1) : (s.percent||0);
-                document.getElementById('eta').textContent = s.eta_readable || (s.eta? Math.floor(s.eta)+'s' : '—');
-                if (s.state === 'done') {
-                    // reload the viewer which should now find the report
-                    location.reload();
-                    return;
-                }
-                if (s.state === 'error') {
-                    document.getElementById('error').textContent = 'Error: ' + (s.error || 'unknown');
-                    return;
-                }
+                version = j.version || 0;
+                render(j.status || {});
+                if (finished) return;
+                setTimeout(poll, waitFor ? 250 : 2000);
             } catch (e) {
                 console.error(e);
+                setTimeout(poll, 1500);
             }
-            setTimeout(poll, 1500);
         }
-        poll();
+        if (window.EventSource) {
+            const es = new EventSource('/events?jobs=' + encodeURIComponent(jobId));
+            es.addEventListener('status', (ev) => {
+                const d = JSON.parse(ev.data);
+                version = parseInt(ev.lastEventId || version, 10);
+                if (!d.status) { es.close(); poll(); return; }
+                render(d.status);
+                if (finished) es.close();
+            });
+            // the server ends each stream after a while and the browser reconnects by itself;
+            // CLOSED means it refused (503) or failed for good
+            es.onerror = () => { if (es.readyState === EventSource.CLOSED && !finished) poll(); };
+        } else {
+            poll();
+        }
     </script>
 </body>
 </html>"""
@@ -245,363 +696,2433 @@ def format_time(secs):
     return f"{s:.1f}s"
 
 
-def process_video_job(video_id, original_filename, video_path, job_id):
-    start_time = time.time()
-    job = {'state': 'processing', 'stage': 'start', 'percent': 0.0, 'processed': 0, 'total': 0, 'start_time': start_time}
-    with JOBS_LOCK:
-        JOBS[job_id] = job
+def detect_frames(frames, det=None):
+    """Run the NSFW detector (`det`, or the shared one) over a batch of frames; returns one
+    detection list per frame."""
+    if det is None:
+        det = detector
+    if det is None or not frames:
+        return [[] for _ in frames]
+    detect_batch = getattr(det, 'detect_batch', None)
+    if detect_batch is not None and len(frames) > 1:
+        try:
+            out = detect_batch(list(frames), batch_size=len(frames))
+            if out is not None and len(out) == len(frames):
+                return [d or [] for d in out]
+        except Exception:
+            pass
+    out = []
+    for f in frames:
+        try:
+            out.append(det.detect(f) or [])
+        except Exception:
+            out.append([])
+    return out
 
+
+def _body_type_from_boxes(boxes, frame_h):
+    if len(boxes) == 0:
+        return 'unknown'
+    if len(boxes) > 1:
+        return 'multiple'
+    x, y, w_box, h_box = boxes[0]
+    h_ratio = float(h_box) / float(frame_h)
+    if h_ratio >= 0.6:
+        return 'full_body'
+    if h_ratio >= 0.35:
+        return 'upper_body'
+    return 'partial_or_face'
+
+
+def infer_body_type(detect_frame):
+    """Classify how much of a person is visible using YOLO, or HOG when YOLO is unavailable."""
     try:
-        job['stage'] = 'opening'
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            job.update({'state': 'error', 'error': 'failed to open video'})
-            return
+        if person_detector is not None:
+            # ultralytics models are not safe to call from several threads at once
+            with PERSON_POOL.checkout() as yolo:
+                yres = yolo(detect_frame)[0]
+            pboxes = []
+            for box, cls in zip(yres.boxes.xyxy, yres.boxes.cls):
+                if int(cls.item()) == 0:
+                    x1, y1, x2, y2 = map(int, box.tolist())
+                    pboxes.append((x1, y1, x2 - x1, y2 - y1))
+            return _body_type_from_boxes(pboxes, detect_frame.shape[0])
+        gray = cv2.cvtColor(detect_frame, cv2.COLOR_BGR2GRAY)
+        rects, _ = _get_hog().detectMultiScale(gray, winStride=(8,8), padding=(8,8), scale=1.05)
+        return _body_type_from_boxes(rects, detect_frame.shape[0])
+    except Exception:
+        return 'unknown'
 
-        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-        duration = (frame_count / fps) if fps > 0 else 0.0
-        job.update({'fps': fps, 'total_frames': frame_count, 'duration': duration})
 
-        step = max(1, int(round(fps / float(max(1, SAMPLE_FPS))))) if fps > 0 else 1
-        estimated_samples = max(1, int(math.ceil(duration * SAMPLE_FPS))) if duration > 0 else 1
-        job['stage'] = 'sampling'
-        job['total'] = estimated_samples
+class ScanStats:
+    """Timing histograms per scan stage plus event counters, safe to share between threads.
 
-        results = []
-        thumb_dir = os.path.join(UPLOAD_FOLDER, 'thumbs')
-        Path(thumb_dir).mkdir(parents=True, exist_ok=True)
+    `to_dict()` gives a plain dict (for reports and for crossing process boundaries) that
+    `merge()` folds into another instance.
+    """
 
-        frame_idx = 0
-        samples_done = 0
-        while True:
-            grabbed = cap.grab()
-            if not grabbed:
-                break
-            if frame_idx % step == 0:
-                ret, frame = cap.retrieve()
-                if not ret or frame is None:
-                    frame_idx += 1
-                    continue
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = Counter()
 
-                ts = float(frame_idx) / fps if fps > 0 else 0.0
+    def observe(self, stage, seconds):
+        with self.lock:
+            st = self.stages.get(stage)
+            if st is None:
+                st = self.stages[stage] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(STAGE_BUCKETS)}
+            st['count'] += 1
+            st['sum'] += seconds
+            st['max'] = max(st['max'], seconds)
+            for i, le in enumerate(STAGE_BUCKETS):
+                if seconds <= le:
+                    st['buckets'][i] += 1
+                    break
 
-                small = safe_resize(frame)
-                dets = []
-                try:
-                    if detector is not None:
-                        dets = detector.detect(small) or []
-                except Exception:
-                    dets = []
+    @contextlib.contextmanager
+    def timed(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
 
-                filtered = [d for d in dets if float(d.get('score', 0.0)) >= SCORE_THRESHOLD]
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
 
-                samples_done += 1
-                job['processed'] = samples_done
-                try:
-                    elapsed = time.time() - start_time
-                    pct = float(samples_done) / float(max(1, job.get('total', 1)))
-                    eta = (elapsed / max(1e-6, pct) - elapsed) if pct > 0 else None
-                    job.update({'percent': round(pct * 100, 1), 'elapsed': elapsed, 'eta': eta})
-                except Exception:
-                    pass
+    def to_dict(self):
+        with self.lock:
+            stages = {}
+            for name, st in self.stages.items():
+                stages[name] = dict(st, buckets=list(st['buckets']), mean=st['sum'] / st['count'] if st['count'] else 0.0)
+            return {'stages': stages, 'counters': dict(self.counters)}
 
-                if not filtered:
-                    frame_idx += 1
-                    continue
+    def merge(self, data):
+        if not data:
+            return
+        with self.lock:
+            for name, other in (data.get('stages') or {}).items():
+                st = self.stages.get(name)
+                if st is None:
+                    st = self.stages[name] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(STAGE_BUCKETS)}
+                st['count'] += other.get('count', 0)
+                st['sum'] += other.get('sum', 0.0)
+                st['max'] = max(st['max'], other.get('max', 0.0))
+                for i, n in enumerate((other.get('buckets') or [])[:len(STAGE_BUCKETS)]):
+                    st['buckets'][i] += n
+            self.counters.update(data.get('counters') or {})
 
-                thumb_name = f"{video_id}_f{frame_idx}.jpg"
-                try:
-                    cv2.imwrite(os.path.join(thumb_dir, thumb_name), frame)
-                except Exception:
-                    pass
 
-                # body type inference
-                body_type = 'unknown'
-                try:
-                    detect_frame = small
-                    if person_detector is not None:
-                        yres = person_detector(detect_frame)[0]
-                        pboxes = []
-                        for box, cls in zip(yres.boxes.xyxy, yres.boxes.cls):
-                            if int(cls.item()) == 0:
-                                x1, y1, x2, y2 = map(int, box.tolist())
-                                pboxes.append((x1, y1, x2 - x1, y2 - y1))
-                        if len(pboxes) == 0:
-                            body_type = 'unknown'
-                        elif len(pboxes) > 1:
-                            body_type = 'multiple'
-                        else:
-                            x, y, w_box, h_box = pboxes[0]
-                            h_ratio = float(h_box) / float(detect_frame.shape[0])
-                            if h_ratio >= 0.6:
-                                body_type = 'full_body'
-                            elif h_ratio >= 0.35:
-                                body_type = 'upper_body'
-                            else:
-                                body_type = 'partial_or_face'
-                    else:
-                        gray = cv2.cvtColor(detect_frame, cv2.COLOR_BGR2GRAY)
-                        rects, _ = hog.detectMultiScale(gray, winStride=(8,8), padding=(8,8), scale=1.05)
-                        if len(rects) == 0:
-                            body_type = 'unknown'
-                        elif len(rects) > 1:
-                            body_type = 'multiple'
-                        else:
-                            x, y, w_box, h_box = rects[0]
-                            h_ratio = float(h_box) / float(detect_frame.shape[0])
-                            if h_ratio >= 0.6:
-                                body_type = 'full_body'
-                            elif h_ratio >= 0.35:
-                                body_type = 'upper_body'
-                            else:
-                                body_type = 'partial_or_face'
-                except Exception:
-                    body_type = 'unknown'
-
-                for d in filtered:
-                    rec = {
-                        'timestamp': float(ts),
-                        'frame_index': frame_idx,
-                        'class': d.get('class') or d.get('label') or 'unknown',
-                        'score': float(d.get('score', 0.0)),
-                        'box': d.get('box', []),
-                        'body_type': body_type,
-                        'thumbnail': f'thumbs/{thumb_name}',
-                    }
-                    results.append(rec)
-
-            frame_idx += 1
+# Totals for this server process, served on /metrics
+METRICS = ScanStats()
 
-        cap.release()
 
-        scan_time = time.time() - start_time
+def _timed_frames(frames, stats):
+    """Pass frames through, timing how long each takes to decode."""
+    frames = iter(frames)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(frames)
+        except StopIteration:
+            return
+        stats.observe('decode', time.perf_counter() - t0)
+        yield item
 
-        # pick best thumbnail
-        best_thumb = ''
-        if results:
-            best = max(results, key=lambda r: r.get('score', 0.0))
-            src = os.path.normpath(os.path.join(UPLOAD_FOLDER, *best.get('thumbnail','').split('/')))
-            if os.path.exists(src):
-                best_thumb = f"{video_id}_best.jpg"
-                try:
-                    shutil.copy2(src, os.path.join(UPLOAD_FOLDER, best_thumb))
-                except Exception:
-                    best_thumb = best.get('thumbnail','')
 
-        # SFW fallback: first frame
-        if not results:
+def write_thumbnail(path, frame):
+    small = safe_resize(frame, THUMB_MAX_WIDTH)
+    return cv2.imwrite(path, small, [int(cv2.IMWRITE_JPEG_QUALITY), int(THUMB_JPEG_QUALITY)])
+
+
+class ThumbnailWriter:
+    """Writes thumbnails on a background thread through a bounded queue.
+
+    Writes are grouped (one group per video) so a job can wait for its own thumbnails
+    without waiting for other jobs sharing the writer. Frames are downscaled to THUMB_MAX_WIDTH
+    in `submit`, so the queue never holds full-resolution frames.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=max(1, int(maxsize)))
+        self.cond = threading.Condition()
+        self.pending = Counter()
+        self.thread = None
+
+    def submit(self, path, frame, group=None, stats=None):
+        frame = safe_resize(frame, THUMB_MAX_WIDTH)
+        with self.cond:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.pending[group] += 1
+        self.queue.put((path, frame, group, stats))
+
+    def wait(self, group=None):
+        """Block until every thumbnail submitted for `group` is on disk."""
+        with self.cond:
+            while self.pending[group] > 0:
+                self.cond.wait()
+
+    def _run(self):
+        while True:
+            path, frame, group, stats = self.queue.get()
             try:
-                cap2 = cv2.VideoCapture(video_path)
-                if cap2.isOpened():
-                    cap2.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    ok, f0 = cap2.read()
-                    if ok and f0 is not None:
-                        tn = f"{video_id}_f0.jpg"
-                        try:
-                            cv2.imwrite(os.path.join(UPLOAD_FOLDER, 'thumbs', tn), f0)
-                            best_thumb = f"{video_id}_best.jpg"
-                            shutil.copy2(os.path.join(UPLOAD_FOLDER, 'thumbs', tn), os.path.join(UPLOAD_FOLDER, best_thumb))
-                        except Exception:
-                            best_thumb = os.path.join('thumbs', tn)
-                    cap2.release()
+                t0 = time.perf_counter()
+                write_thumbnail(path, frame)
+                if stats is not None:
+                    stats.observe('thumbnail', time.perf_counter() - t0)
             except Exception:
                 pass
+            finally:
+                with self.cond:
+                    self.pending[group] -= 1
+                    if self.pending[group] <= 0:
+                        del self.pending[group]
+                        self.cond.notify_all()
 
-        # merge segments
-        MERGE_GAP = 10.0
-        segments = []
-        try:
-            from collections import defaultdict, Counter
-            grouped = defaultdict(list)
-            for r in results:
-                grouped[r.get('class','unknown')].append(r)
-            for cls, items in grouped.items():
-                items.sort(key=lambda x: x.get('timestamp',0.0))
-                cur = None
-                for it in items:
-                    if cur is None:
-                        cur = {'class': cls, 'start': it.get('timestamp',0.0), 'end': it.get('timestamp',0.0), 'scores':[it.get('score',0.0)], 'thumbnails':[it.get('thumbnail','')], 'body_types':[it.get('body_type','unknown')], 'count':1, 'best': it}
-                    else:
-                        if it.get('timestamp',0.0) <= cur['end'] + MERGE_GAP:
-                            cur['end'] = max(cur['end'], it.get('timestamp',0.0))
-                            cur['scores'].append(it.get('score',0.0))
-                            cur['thumbnails'].append(it.get('thumbnail',''))
-                            cur['body_types'].append(it.get('body_type','unknown'))
-                            cur['count'] += 1
-                            if it.get('score',0.0) > cur['best'].get('score',0.0):
-                                cur['best'] = it
-                        else:
-                            bt = Counter(cur['body_types']).most_common(1)[0][0] if cur['body_types'] else 'unknown'
-                            thumb = cur['best'].get('thumbnail','') or ''
-                            if thumb:
-                                thumb = thumb.replace('\\','/').lstrip('/')
-                            display_start = float(cur['best'].get('timestamp', cur['start']))
-                            seg = {'class': cur['class'], 'start': display_start, 'end': float(cur['end']), 'score': float(max(cur['scores'])), 'thumbnail': thumb, 'body_type': bt, 'count': cur['count']}
-                            segments.append(seg)
-                            cur = {'class': cls, 'start': it.get('timestamp',0.0), 'end': it.get('timestamp',0.0), 'scores':[it.get('score',0.0)], 'thumbnails':[it.get('thumbnail','')], 'body_types':[it.get('body_type','unknown')], 'count':1, 'best': it}
-                if cur is not None:
-                    bt = Counter(cur['body_types']).most_common(1)[0][0] if cur['body_types'] else 'unknown'
-                    thumb = cur['best'].get('thumbnail','') or ''
-                    if thumb:
-                        thumb = thumb.replace('\\','/').lstrip('/')
-                    display_start = float(cur['best'].get('timestamp', cur['start']))
-                    seg = {'class': cur['class'], 'start': display_start, 'end': float(cur['end']), 'score': float(max(cur['scores'])), 'thumbnail': thumb, 'body_type': bt, 'count': cur['count']}
-                    segments.append(seg)
-        except Exception:
-            segments = []
 
-        # write report
-        report = {
-            'video': original_filename,
-            'video_id': video_id,
-            'duration': duration,
-            'fps': fps,
-            'detections': results,
-            'best_thumbnail': best_thumb,
-            'segments': segments,
-            'scan_time': scan_time,
-        }
+THUMB_WRITER = ThumbnailWriter(THUMB_QUEUE_SIZE)
+
+
+def _sprite_tile(img):
+    """Centre-crop `img` to the tile aspect ratio and scale it to the tile size."""
+    h, w = img.shape[:2]
+    tw, th = SPRITE_TILE_WIDTH, SPRITE_TILE_HEIGHT
+    if w * th > h * tw:
+        cw = max(1, h * tw // th)
+        img = img[:, (w - cw) // 2:(w - cw) // 2 + cw]
+    else:
+        ch = max(1, w * th // tw)
+        img = img[(h - ch) // 2:(h - ch) // 2 + ch]
+    return cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+
+
+def write_sprite(path, images):
+    """Tile the image files of `images` ((name, path) pairs) into one JPEG sprite sheet at `path`.
+
+    Returns the layout, {'file', 'columns', 'rows', 'tiles': [name, ...]} with tiles in sheet order,
+    or None when no image could be read. Unreadable images and repeated names are left out.
+    """
+    names, tiles = [], []
+    for name, p in images:
+        if len(tiles) >= SPRITE_MAX_TILES:
+            break
+        if name in names:
+            continue
+        img = cv2.imread(p)
+        if img is None:
+            continue
+        names.append(name)
+        tiles.append(_sprite_tile(img))
+    if not tiles:
+        return None
+    columns = min(max(1, SPRITE_COLUMNS), len(tiles))
+    rows = int(math.ceil(len(tiles) / float(columns)))
+    sheet = np.zeros((rows * SPRITE_TILE_HEIGHT, columns * SPRITE_TILE_WIDTH, 3), dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        r, c = divmod(i, columns)
+        sheet[r * SPRITE_TILE_HEIGHT:(r + 1) * SPRITE_TILE_HEIGHT, c * SPRITE_TILE_WIDTH:(c + 1) * SPRITE_TILE_WIDTH] = tile
+    if not cv2.imwrite(path, sheet, [int(cv2.IMWRITE_JPEG_QUALITY), int(THUMB_JPEG_QUALITY)]):
+        return None
+    return {'file': os.path.basename(path), 'columns': columns, 'rows': rows, 'tiles': names}
+
+
+def score_heatmap(results, duration, bin_seconds=None):
+    """Highest detection score (0-100) in each `bin_seconds` of the video."""
+    bin_seconds = float(bin_seconds or HEATMAP_BIN_SECONDS)
+    ts = np.array([r.get('timestamp', 0.0) for r in results], dtype=np.float64)
+    sc = np.array([r.get('score', 0.0) for r in results], dtype=np.float64)
+    n = int(math.ceil(duration / bin_seconds)) if duration > 0 else 0
+    if len(ts):
+        n = max(n, int(ts.max() // bin_seconds) + 1)
+    heat = np.zeros(max(1, n))
+    if len(ts):
+        np.maximum.at(heat, np.clip((ts // bin_seconds).astype(np.int64), 0, len(heat) - 1), sc)
+    return {'bin_seconds': bin_seconds, 'scores': np.round(heat * 100).astype(int).tolist()}
+
+
+def classify_segments(video_path, segments, stats=None):
+    """Fill in body_type for segments still marked 'pending', from each segment's best frame.
+
+    Returns True if any segment changed. Segments sharing a best frame are classified once.
+    """
+    stats = stats or ScanStats()
+    todo = [sg for sg in segments if sg.get('body_type') == 'pending']
+    if not todo:
+        return False
+    ensure_models()
+    done = {}
+    cap = cv2.VideoCapture(video_path)
+    try:
+        for sg in todo:
+            fidx = sg.get('frame_index')
+            if fidx not in done:
+                body_type = 'unknown'
+                if fidx is not None and cap.isOpened():
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, int(fidx))
+                    ok, frame = cap.read()
+                    if ok and frame is not None:
+                        with stats.timed('body_type'):
+                            body_type = infer_body_type(safe_resize(frame))
+                done[fidx] = body_type
+            sg['body_type'] = done[fidx]
+    finally:
+        cap.release()
+    return True
+
+
+def apply_segment_body_types(results, segments):
+    """Copy each segment's body_type onto the detections it was merged from."""
+    by_class = defaultdict(list)
+    for sg in segments:
+        by_class[sg.get('class', 'unknown')].append(sg)
+    grouped = defaultdict(list)
+    for r in results:
+        grouped[r.get('class', 'unknown')].append(r)
+    for cls, items in grouped.items():
+        segs = by_class.get(cls) or []
+        k = 0
+        for it in sorted(items, key=lambda x: x.get('timestamp', 0.0)):
+            while k < len(segs) - 1 and it.get('timestamp', 0.0) > segs[k]['end']:
+                k += 1
+            if segs:
+                it['body_type'] = segs[k].get('body_type', 'unknown')
+
+
+def _job_changed(job_id):
+    """Record a change to JOBS[job_id] and wake anyone waiting for it. Caller must hold JOBS_LOCK."""
+    global _jobs_version
+    _jobs_version += 1
+    JOB_VERSIONS[job_id] = _jobs_version
+    JOBS_CHANGED.notify_all()
+
+
+class _LiveJob(dict):
+    """Job dict used by in-process scans; every change wakes /events and long-poll waiters."""
+
+    def __init__(self, job_id, initial):
+        super().__init__(initial)
+        self.job_id = job_id
+
+    def __setitem__(self, key, value):
+        with JOBS_LOCK:
+            super().__setitem__(key, value)
+            _job_changed(self.job_id)
+
+    def update(self, *args, **kwargs):
+        with JOBS_LOCK:
+            super().update(*args, **kwargs)
+            _job_changed(self.job_id)
+
+
+class _ProgressJob(dict):
+    """Job dict used inside a scan process; every change is forwarded to the parent's JOBS."""
+
+    def __init__(self, job_id, initial):
+        super().__init__(initial)
+        self.job_id = job_id
+        self._send('set', dict(self))
+
+    def _send(self, kind, changes):
         try:
-            with open(os.path.join(UPLOAD_FOLDER, f"{video_id}_report.json"), 'w', encoding='utf-8') as fh:
-                json.dump(report, fh, indent=2)
+            _progress_queue.put((kind, self.job_id, changes))
         except Exception:
             pass
 
-        # finalize job
-        view_t = segments[0].get('start', 0) if segments else (results[0].get('timestamp', 0) if results else 0)
-        job.update({'state': 'done', 'percent': 100.0, 'view': f'/view/{video_id}?t={view_t}', 'scan_time': scan_time})
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._send('update', {key: value})
 
-    except Exception as e:
-        job.update({'state': 'error', 'error': str(e)})
-    finally:
-        with JOBS_LOCK:
-            JOBS[job_id] = job
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        self._send('update', changes)
 
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    if request.method == 'GET':
-        cards = []
-        for p in Path(UPLOAD_FOLDER).glob('*_report.json'):
-            try:
-                with open(p, 'r', encoding='utf-8') as fh:
-                    rep = json.load(fh)
-                dets = rep.get('detections', [])
-                segs = rep.get('segments', [])
-                if segs:
-                    first_ts = segs[0].get('start', 0)
-                else:
-                    first_ts = dets[0].get('timestamp') if dets else 0
-                thumb = rep.get('best_thumbnail') or ''
-                if thumb:
-                    thumb = thumb.replace('\\','/').lstrip('/')
-                tags = []
-                if dets:
-                    freq = {}
-                    for d in dets:
-                        cls = d.get('class')
-                        if cls:
-                            freq[cls] = freq.get(cls, 0) + 1
-                    tags = sorted(freq.keys(), key=lambda k: -freq[k])
-                else:
-                    tags = ['SAFE']
-                cards.append({'video_id': rep.get('video_id'), 'video_name': rep.get('video'), 'first_ts': first_ts, 'thumb': thumb, 'tags': tags, 'scan_time': rep.get('scan_time', 0)})
-            except Exception:
-                continue
-        return render_template_string(INDEX_HTML, cards=cards, format_time=format_time)
+def merge_segments(results, gap=None):
+    """Merge per-frame detections of the same class that are at most `gap` seconds apart."""
+    return segment_merge.merge_segments(results, MERGE_GAP if gap is None else float(gap))
 
-    # POST: upload file -> start background job
-    f = request.files.get('video')
-    if not f or f.filename == '':
-        return jsonify({'ok': False, 'error': 'no file'}), 400
-    original = f.filename
-    video_id = str(uuid.uuid4())
-    video_path = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
-    f.save(video_path)
 
-    job_id = video_id
-    with JOBS_LOCK:
-        JOBS[job_id] = {'state': 'queued', 'stage': 'queued', 'percent': 0.0, 'processed': 0, 'total': 0, 'start_time': time.time()}
+def sample_step(fps, rate):
+    """Number of source frames between samples when sampling `rate` frames per second."""
+    if fps <= 0 or rate <= 0:
+        return 1
+    return max(1, int(round(fps / float(rate))))
 
-    t = threading.Thread(target=process_video_job, args=(video_id, original, video_path, job_id), daemon=True)
-    t.start()
 
-    return jsonify({'ok': True, 'job': job_id, 'view': f'/view/{video_id}'}), 200
+def hit_windows(frame_indices, radius, frame_count):
+    """Merge [f - radius, f + radius] windows around hit frames into sorted, non-overlapping ranges."""
+    windows = []
+    for f in sorted(set(frame_indices)):
+        a = max(0, f - radius)
+        b = f + radius + 1
+        if frame_count > 0:
+            b = min(b, frame_count)
+        if windows and a <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], b))
+        else:
+            windows.append((a, b))
+    return windows
 
 
-@app.route('/status/<job_id>')
-def status(job_id):
-    j = JOBS.get(job_id)
-    if not j:
-        return jsonify({'ok': False, 'error': 'not found'}), 404
-    out = dict(j)
-    eta = out.get('eta')
-    if eta is not None:
-        out['eta_readable'] = f"{int(eta//60)}m {int(eta%60)}s"
-    return jsonify({'ok': True, 'status': out})
+def split_frame_ranges(frame_count, step, parts):
+    """Split [0, frame_count) into up to `parts` contiguous ranges whose starts fall on the sampling grid."""
+    samples = int(math.ceil(frame_count / float(step))) if frame_count > 0 else 0
+    parts = max(1, min(int(parts), samples))
+    if parts <= 1:
+        return [(0, None)]
+    ranges = []
+    for i in range(parts):
+        s0 = (samples * i // parts) * step
+        s1 = (samples * (i + 1) // parts) * step
+        ranges.append((s0, s1 if i < parts - 1 else None))
+    return ranges
 
 
-@app.route('/uploads/<path:filename>')
-def uploaded(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+def coarse_to_fine(n):
+    """Indices 0..n-1 ordered coarse to fine: a power-of-two stride across the whole range first,
+    then the midpoints between the indices visited so far, halving until every index is visited."""
+    if n <= 0:
+        return []
+    stride = 1
+    while stride * 2 < n:
+        stride *= 2
+    order = list(range(0, n, stride))
+    while stride > 1:
+        order.extend(range(stride // 2, n, stride))
+        stride //= 2
+    return order
 
 
-@app.route('/delete/<video_id>', methods=['POST'])
-def delete_video(video_id):
-    removed = []
-    errors = []
+def resolve_sampling_mode(mode):
+    """Return the sampling mode a job will actually use for the requested one."""
+    mode = (mode or SAMPLING_MODE or 'grab').lower()
+    if mode not in SAMPLING_MODES:
+        mode = 'grab'
+    if mode == 'keyframe' and av is None:
+        mode = 'seek'
+    return mode
+
+
+def _iter_grab(cap, step, start, end):
+    frame_idx = start
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    while end is None or frame_idx < end:
+        if not cap.grab():
+            break
+        if frame_idx % step == 0:
+            ret, frame = cap.retrieve()
+            if ret and frame is not None:
+                yield frame_idx, frame
+        frame_idx += 1
+
+
+def _iter_seek(cap, step, start, end):
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    target = ((start + step - 1) // step) * step
+    pos = 0
+    while end is None or target < end:
+        if end is None and frame_count > 0 and target >= frame_count:
+            break
+        gap = target - pos
+        if gap < 0 or gap > SEEK_MIN_GAP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        else:
+            ok = True
+            for _ in range(gap):
+                if not cap.grab():
+                    ok = False
+                    break
+            if not ok:
+                break
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            break
+        yield target, frame
+        pos = target + 1
+        target += step
+
+
+def _iter_keyframes(video_path, fps, step, start, end):
+    container = av.open(video_path)
     try:
-        v = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
-        if os.path.exists(v):
-            os.remove(v); removed.append(v)
-        r = os.path.join(UPLOAD_FOLDER, f"{video_id}_report.json")
-        if os.path.exists(r):
-            os.remove(r); removed.append(r)
-        b = os.path.join(UPLOAD_FOLDER, f"{video_id}_best.jpg")
-        if os.path.exists(b):
-            os.remove(b); removed.append(b)
-        tdir = os.path.join(UPLOAD_FOLDER, 'thumbs')
-        if os.path.isdir(tdir):
-            for p in Path(tdir).glob(f"{video_id}_f*.jpg"):
-                try:
-                    os.remove(str(p)); removed.append(str(p))
-                except Exception:
-                    errors.append(str(p))
-    except Exception as e:
-        return jsonify({'ok': False, 'error': str(e)}), 500
-    return jsonify({'ok': True, 'removed': removed, 'errors': errors})
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = 'NONKEY'
+        if start > 0 and fps > 0 and stream.time_base:
+            container.seek(int(start / fps / stream.time_base), stream=stream, backward=True)
+        last_idx = None
+        for frame in container.decode(stream):
+            if frame.pts is None:
+                continue
+            fidx = int(round(float(frame.pts * stream.time_base) * fps)) if fps > 0 else 0
+            if fidx < start:
+                continue
+            if end is not None and fidx >= end:
+                break
+            # all-intra streams would otherwise be scanned frame by frame
+            if last_idx is not None and fidx - last_idx < step:
+                continue
+            last_idx = fidx
+            yield fidx, frame.to_ndarray(format='bgr24')
+    finally:
+        container.close()
 
 
-@app.route('/view/<video_id>')
-def view_video(video_id):
-    report = None
-    for p in Path(UPLOAD_FOLDER).glob(f'{video_id}_report.json'):
-        try:
-            with open(p, 'r', encoding='utf-8') as fh:
-                report = json.load(fh); break
-        except Exception:
-            continue
-    if not report:
+def iter_sampled_frames(video_path, fps, step, start=0, end=None, mode='grab'):
+    """Yield (frame_index, frame) for the frames to scan in [start, end) using the given sampling mode."""
+    if mode == 'keyframe':
+        yield from _iter_keyframes(video_path, fps, step, start, end)
+        return
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise RuntimeError('failed to open video')
+        if mode == 'seek':
+            yield from _iter_seek(cap, step, start, end)
+        else:
+            yield from _iter_grab(cap, step, start, end)
+    finally:
+        cap.release()
+
+
+def iter_frames_at(video_path, fps, targets, mode='grab'):
+    """Yield (frame_index, frame) for the target frames in the order given, seeking to each one.
+
+    In 'keyframe' mode a target gives the keyframe at or before it, and each keyframe is
+    returned once.
+    """
+    if mode == 'keyframe' and fps > 0:
+        container = av.open(video_path)
+        try:
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = 'NONKEY'
+            seen = set()
+            for t in targets:
+                container.seek(int(t / fps / stream.time_base), stream=stream, backward=True)
+                for frame in container.decode(stream):
+                    if frame.pts is None:
+                        continue
+                    fidx = int(round(float(frame.pts * stream.time_base) * fps))
+                    if fidx not in seen:
+                        seen.add(fidx)
+                        yield fidx, frame.to_ndarray(format='bgr24')
+                    break
+        finally:
+            container.close()
+        return
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise RuntimeError('failed to open video')
+        for t in targets:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, t)
+            ret, frame = cap.read()
+            if ret and frame is not None:
+                yield t, frame
+    finally:
+        cap.release()
+
+
+def _upload_meta_path(video_id):
+    return os.path.join(UPLOAD_FOLDER, f"{video_id}.upload.json")
+
+
+def upload_in_progress(video_id):
+    """True while a chunked upload for this video has not been finished."""
+    return os.path.exists(_upload_meta_path(video_id))
+
+
+def iter_growing_frames(video_path, video_id, fps, step, start=0, end=None, mode='grab'):
+    """Like iter_sampled_frames, for a file that is still being uploaded.
+
+    Each pass reads as far as the bytes on disk allow, then waits for the file to grow and
+    resumes after the last frame it returned, until the upload is finished. The last frame of
+    a pass may come from a truncated packet, so it is only returned once a later one decodes.
+    Raises RuntimeError when the file stops growing for STREAM_STALL_TIMEOUT seconds.
+    """
+    next_idx = start
+    last_size, last_growth = -1, time.time()
+    while True:
+        finished = not upload_in_progress(video_id)
+        held = None
+        try:
+            for fidx, frame in iter_sampled_frames(video_path, fps, step, next_idx, end, mode):
+                if held is not None:
+                    next_idx = held[0] + 1
+                    yield held
+                held = (fidx, frame)
+        except Exception:
+            # a truncated file can fail to open or decode; only an error once complete
+            if finished:
+                raise
+        if finished:
+            if held is not None:
+                yield held
+            return
+        while upload_in_progress(video_id):
+            size = os.path.getsize(video_path)
+            if size != last_size:
+                last_size, last_growth = size, time.time()
+                break
+            if time.time() - last_growth > STREAM_STALL_TIMEOUT:
+                # the job fails rather than report on part of the file; finishing the upload
+                # later queues a normal scan
+                raise RuntimeError('upload stalled')
+            time.sleep(STREAM_POLL_INTERVAL)
+
+
+def frame_fingerprint(small):
+    """Difference hash plus a 4x4 colour layout of a detection-sized frame.
+
+    The hash captures structure; the colour layout catches fades and recolours that leave
+    gradients unchanged.
+    """
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    tiny = cv2.resize(gray, (FINGERPRINT_SIZE + 1, FINGERPRINT_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (tiny[:, 1:] > tiny[:, :-1]).ravel()
+    colour = cv2.resize(small, (4, 4), interpolation=cv2.INTER_AREA).astype(np.int16).ravel()
+    return bits, colour
+
+
+def fingerprints_match(a, b):
+    """True when two fingerprints are close enough to share detection results."""
+    if np.count_nonzero(a[0] != b[0]) > GATE_MAX_DISTANCE:
+        return False
+    return int(np.abs(a[1] - b[1]).max()) <= GATE_MAX_COLOR_DELTA
+
+
+_db_local = threading.local()
+
+
+def _db_conn(path, schema):
+    """Per-thread SQLite connection to `path`, creating the schema on first use."""
+    conns = getattr(_db_local, 'conns', None)
+    if conns is None:
+        conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(schema)
+        conn.commit()
+        conns[path] = conn
+    return conn
+
+
+FRAME_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (key TEXT PRIMARY KEY, dets TEXT NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS frames_used ON frames (used);
+"""
+
+
+def fingerprint_key(small, fp):
+    """Cache key for a detection-sized frame: namespace, frame size, hash bits and coarse colours."""
+    h, w = small.shape[:2]
+    bits = np.packbits(fp[0]).tobytes().hex()
+    colour = (fp[1] >> 4).astype(np.uint8).tobytes().hex()
+    return f"{FRAME_CACHE_NAMESPACE}:{w}x{h}:{bits}:{colour}"
+
+
+def _json_default(o):
+    return o.item() if hasattr(o, 'item') else str(o)
+
+
+def frame_cache_get(keys):
+    """Look up cached detections; returns {key: dets} for the keys that are present."""
+    if FRAME_CACHE_MAX_ENTRIES <= 0 or not keys:
+        return {}
+    try:
+        conn = _db_conn(FRAME_CACHE_FILE, FRAME_CACHE_SCHEMA)
+        marks = ','.join('?' * len(keys))
+        rows = conn.execute(f'SELECT key, dets FROM frames WHERE key IN ({marks})', list(keys)).fetchall()
+        if rows:
+            conn.execute(f'UPDATE frames SET used = ? WHERE key IN ({marks})', [time.time()] + [r[0] for r in rows])
+            conn.commit()
+        return {k: json.loads(d) for k, d in rows}
+    except Exception:
+        return {}
+
+
+_frame_cache_writes = 0
+_frame_cache_writes_lock = threading.Lock()
+
+
+def frame_cache_put(items):
+    """Store (key, dets) pairs, evicting the least recently used overflow every FRAME_CACHE_EVICT_EVERY writes."""
+    global _frame_cache_writes
+    if FRAME_CACHE_MAX_ENTRIES <= 0 or not items:
+        return
+    with _frame_cache_writes_lock:
+        _frame_cache_writes += len(items)
+        evict = _frame_cache_writes >= FRAME_CACHE_EVICT_EVERY
+        if evict:
+            _frame_cache_writes = 0
+    try:
+        conn = _db_conn(FRAME_CACHE_FILE, FRAME_CACHE_SCHEMA)
+        now = time.time()
+        conn.executemany('INSERT OR REPLACE INTO frames (key, dets, used) VALUES (?, ?, ?)',
+                         [(k, json.dumps(d, default=_json_default), now) for k, d in items])
+        excess = conn.execute('SELECT COUNT(*) FROM frames').fetchone()[0] - FRAME_CACHE_MAX_ENTRIES if evict else 0
+        if excess > 0:
+            conn.execute('DELETE FROM frames WHERE key IN (SELECT key FROM frames ORDER BY used LIMIT ?)', (excess,))
+        conn.commit()
+    except Exception:
+        pass
+
+
+class ScanCheckpoint:
+    """On-disk progress of one scan, so a restarted job carries on where it stopped.
+
+    Keeps, per frame range, the next frame to read and the hit records found before it, plus the
+    job's counters from `counters()`. Records are appended to <job>.ndjson and <job>.json (cursors
+    and how many records of each range are final) is replaced after the append, so a crash while
+    saving loses at most one interval. A checkpoint whose `signature` differs from the current
+    scan's (other file, settings or ranges) is thrown away.
+    """
+
+    def __init__(self, directory, job_id, signature, counters=None, video_id=None):
+        self.directory = directory
+        self.base = os.path.join(directory, job_id)
+        # as it reads back from JSON, so tuples and lists compare equal
+        self.signature = json.loads(json.dumps(signature, default=_json_default))
+        self.counters = counters
+        self.video_id = video_id
+        self.lock = threading.Lock()
+        self.ranges = {}
+        self.restored = {}
+        self.saved_at = time.time()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.base + '.json', 'r', encoding='utf-8') as fh:
+                state = json.load(fh)
+        except Exception:
+            return
+        saved = state.get('ranges') or {}
+        kept = {key: [] for key in saved}
+        if state.get('signature') == self.signature:
+            try:
+                with open(self.base + '.ndjson', 'r', encoding='utf-8') as fh:
+                    for line in fh:
+                        try:
+                            key, rec = json.loads(line)
+                        except ValueError:
+                            continue
+                        # lines after a range's count were appended by a save that never finished
+                        if key in kept and len(kept[key]) < saved[key]['count']:
+                            kept[key].append(rec)
+            except OSError:
+                pass
+        if state.get('signature') != self.signature or any(len(kept[k]) != saved[k]['count'] for k in saved):
+            self.discard()
+            return
+        for key, r in saved.items():
+            self.ranges[key] = {'next': r['next'], 'done': r.get('done', False), 'results': kept[key], 'count': r['count'], 'saved': 0}
+        self.restored = state.get('counters') or {}
+        # start the record file over with only the records that count
+        with self.lock:
+            self._write(truncate=True)
+
+    def resume(self, key, start):
+        """(first frame to read or None if the range is finished, hit records found before it)."""
+        with self.lock:
+            r = self.ranges.setdefault(key, {'next': start, 'done': False, 'results': [], 'count': 0, 'saved': 0})
+            return (None if r['done'] else r['next']), r['results']
+
+    def advance(self, key, next_frame, count, done=False):
+        """Mark the first `count` records of a range final up to `next_frame`; saves when due."""
+        with self.lock:
+            r = self.ranges[key]
+            r.update({'next': next_frame, 'count': count, 'done': done})
+            if time.time() - self.saved_at >= CHECKPOINT_INTERVAL:
+                # hits must not point at thumbnails that were never written
+                if self.video_id is not None:
+                    THUMB_WRITER.wait(self.video_id)
+                self._write()
+
+    def _write(self, truncate=False):
+        """Append unsaved records and replace the state file. Caller must hold self.lock."""
+        self.saved_at = time.time()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.base + '.ndjson', 'w' if truncate else 'a', encoding='utf-8') as fh:
+                for key, r in self.ranges.items():
+                    for rec in r['results'][r['saved']:r['count']]:
+                        fh.write(json.dumps([key, rec], default=_json_default) + '\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+            for r in self.ranges.values():
+                r['saved'] = r['count']
+            state = {'signature': self.signature, 'counters': self.counters() if self.counters else self.restored,
+                     'ranges': {k: {'next': r['next'], 'done': r['done'], 'count': r['count']} for k, r in self.ranges.items()}}
+            tmp = self.base + '.json.tmp'
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump(state, fh)
+            os.replace(tmp, self.base + '.json')
+        except Exception:
+            pass
+
+    def discard(self):
+        remove_checkpoint(self.directory, os.path.basename(self.base))
+
+
+def remove_checkpoint(directory, job_id):
+    """Delete a job's checkpoint files; returns the paths removed."""
+    removed = []
+    for suffix in ('.json', '.ndjson', '.json.tmp'):
+        p = os.path.join(directory, job_id + suffix)
+        try:
+            os.remove(p)
+            removed.append(p)
+        except OSError:
+            pass
+    return removed
+
+
+def scan_frame_range(video_path, video_id, fps, step, start, end, thumb_dir, on_sample=None, mode='grab', on_hit=None, follow_upload=False, stats=None, checkpoint=None,
+                     frames=None, stop_score=None):
+    """Sample the frames of [start, end) with the given sampling mode and return the hit records.
+
+    `end` of None scans to the end of the stream. `on_sample(source)` is called once per sampled
+    frame, with source 'model' when the detector ran, 'cache' when the frame cache answered and
+    'gate' when the frame reused the results of a near-identical earlier frame. `on_hit(frame_index,
+    score, frame)` is called for every frame with detections, with its highest score and the
+    frame downscaled to THUMB_MAX_WIDTH. With
+    `follow_upload` the file is still being uploaded and the scan keeps up with it. Stage timings
+    and frame counters go to `stats` (a ScanStats). With a `checkpoint` (ScanCheckpoint) the
+    range starts after the frames it already covers and reports its progress to it.
+
+    `frames` ((frame_index, frame) pairs) replaces the sampled frames of the range. With
+    `stop_score` the scan ends after the first detector batch with a hit scoring that much.
+    """
+    stats = stats or ScanStats()
+    results = []
+    key = f'{step}:{start}:{end}'
+    if checkpoint is not None:
+        start, results = checkpoint.resume(key, start)
+        if start is None:
+            return results
+
+    def flush_batch(batch):
+        fresh = [e for e in batch if e['source'] is None]
+        cached = frame_cache_get([e['key'] for e in fresh if e.get('key')])
+        for e in fresh:
+            if e.get('key') in cached:
+                e['dets'] = cached[e['key']]
+                e['cached'] = True
+        misses = [e for e in fresh if 'dets' not in e]
+        if misses:
+            t0 = time.perf_counter()
+            with DETECTOR_POOL.checkout() as det:
+                stats.observe('detector_wait', time.perf_counter() - t0)
+                with stats.timed('detect'):
+                    detected = detect_frames([e['small'] for e in misses], det)
+            for e, dets in zip(misses, detected):
+                e['dets'] = dets
+        for e in batch:
+            src = e['source'] or e
+            fidx, frame = e['frame_index'], e.pop('frame')
+            e.pop('small', None)
+            ts = float(fidx) / fps if fps > 0 else 0.0
+            filtered = [d for d in src['dets'] if float(d.get('score', 0.0)) >= SCORE_THRESHOLD]
+
+            source = 'gate' if e['source'] is not None else ('cache' if e.get('cached') else 'model')
+            stats.count('frames_sampled')
+            stats.count('frames_' + {'gate': 'skipped', 'cache': 'cached', 'model': 'detected'}[source])
+            if on_sample is not None:
+                on_sample(source)
+
+            if not filtered:
+                continue
+
+            stats.count('frames_hit')
+            stats.count('detections', len(filtered))
+            thumb_name = f"{video_id}_f{fidx}.jpg"
+            # only the thumbnail-sized frame outlives this iteration
+            thumb = safe_resize(frame, THUMB_MAX_WIDTH)
+            THUMB_WRITER.submit(os.path.join(thumb_dir, thumb_name), thumb, video_id, stats)
+            if on_hit is not None:
+                on_hit(fidx, max(float(d.get('score', 0.0)) for d in filtered), thumb)
+
+            for d in filtered:
+                rec = {
+                    'timestamp': float(ts),
+                    'frame_index': fidx,
+                    'class': d.get('class') or d.get('label') or 'unknown',
+                    'score': float(d.get('score', 0.0)),
+                    'box': d.get('box', []),
+                    'body_type': 'pending',
+                    'thumbnail': f'thumbs/{thumb_name}',
+                }
+                results.append(rec)
+
+        frame_cache_put([(e['key'], e['dets']) for e in fresh if e.get('key') and not e.get('cached')])
+
+    pending = []
+    # fingerprint of the last frame that went through the detector, and its entry
+    reference = None
+    if frames is None and follow_upload:
+        frames = iter_growing_frames(video_path, video_id, fps, step, start, end, mode)
+    elif frames is None:
+        frames = iter_sampled_frames(video_path, fps, step, start, end, mode)
+    for frame_idx, frame in _timed_frames(frames, stats):
+        with stats.timed('resize'):
+            small = safe_resize(frame)
+        entry = {'frame_index': frame_idx, 'frame': frame, 'small': small, 'source': None}
+        if GATE_MAX_DISTANCE >= 0 or FRAME_CACHE_MAX_ENTRIES > 0:
+            fp = frame_fingerprint(small)
+            if GATE_MAX_DISTANCE >= 0 and reference is not None and fingerprints_match(fp, reference[0]):
+                entry['source'] = reference[1]
+            else:
+                reference = (fp, entry)
+                if FRAME_CACHE_MAX_ENTRIES > 0:
+                    entry['key'] = fingerprint_key(small, fp)
+        pending.append(entry)
+        if len(pending) >= max(1, DETECT_BATCH_SIZE):
+            found = len(results)
+            flush_batch(pending)
+            if checkpoint is not None:
+                checkpoint.advance(key, pending[-1]['frame_index'] + 1, len(results))
+            pending = []
+            if stop_score is not None and any(r['score'] >= stop_score for r in results[found:]):
+                break
+    if pending:
+        flush_batch(pending)
+    if checkpoint is not None:
+        checkpoint.advance(key, None, len(results), done=True)
+    return results
+
+
+def _start_job(job_id, initial):
+    """Put a new job dict in JOBS whose changes reach waiters, from this process or a scan process."""
+    job = _ProgressJob(job_id, initial) if _progress_queue is not None else _LiveJob(job_id, initial)
+    with JOBS_LOCK:
+        JOBS[job_id] = job
+        _job_changed(job_id)
+    return job
+
+
+def classify_report_job(video_id, job_id):
+    """Classify the segments of a stored report still marked 'pending' and save them in the report.
+
+    Queued by view_video, so the models load on a scan worker rather than in a web request.
+    Returns the job's ScanStats.to_dict() like process_video_job.
+    """
+    stats = ScanStats()
+    job = _start_job(job_id, {'state': 'processing', 'stage': 'classifying', 'percent': 0.0, 'processed': 0, 'total': 0, 'start_time': time.time()})
+    try:
+        if not MODELS_READY.is_set():
+            job['stage'] = 'loading models'
+            ensure_models()
+        job['stage'] = 'classifying'
+        path = report_io.report_path(UPLOAD_FOLDER, video_id)
+        report = report_io.read_report(path, detections=True)
+        segments = report.get('segments') or []
+        if classify_segments(os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4"), segments, stats):
+            apply_segment_body_types(report['detections'], segments)
+            # keep the report's place in the library, which is ordered by scan time
+            scanned_at = os.path.getmtime(path)
+            try:
+                row = _db_conn(LIBRARY_DB, LIBRARY_SCHEMA).execute('SELECT scanned_at FROM reports WHERE video_id = ?', (video_id,)).fetchone()
+                if row and row[0]:
+                    scanned_at = row[0]
+            except Exception:
+                pass
+            header = report_io.write_report(path, report)
+            store_report(header, report_mtime=os.path.getmtime(path), scanned_at=scanned_at)
+        job.update({'state': 'done', 'percent': 100.0, 'view': f'/view/{video_id}'})
+    except Exception as e:
+        job.update({'state': 'error', 'error': str(e)})
+    finally:
+        with JOBS_LOCK:
+            JOBS[job_id] = job
+            _job_changed(job_id)
+    return stats.to_dict()
+
+
+def process_video_job(video_id, original_filename, video_path, job_id, options=None, out_dir=None, store=True):
+    """Scan one video, keeping JOBS[job_id] up to date, and write its report.
+
+    The report, best thumbnail and thumbs/ go to `out_dir` (UPLOAD_FOLDER by default); with
+    `store` the report is also added to the library store. Returns the job's stage timings
+    and counters (ScanStats.to_dict()) for the caller to add to the process-wide METRICS.
+    """
+    options = options or {}
+    out_dir = out_dir or UPLOAD_FOLDER
+    start_time = time.time()
+    stats = ScanStats()
+    job = _start_job(job_id, {'state': 'processing', 'stage': 'start', 'percent': 0.0, 'processed': 0, 'total': 0, 'frames_skipped': 0, 'frames_cached': 0, 'start_time': start_time})
+
+    try:
+        if not MODELS_READY.is_set():
+            job['stage'] = 'loading models'
+            ensure_models()
+        job['stage'] = 'opening'
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            job.update({'state': 'error', 'error': 'failed to open video'})
+            return stats.to_dict()
+
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        duration = (frame_count / fps) if fps > 0 else 0.0
+        cap.release()
+        sampling_mode = resolve_sampling_mode(options.get('sampling'))
+        job.update({'fps': fps, 'total_frames': frame_count, 'duration': duration, 'sampling_mode': sampling_mode})
+
+        scan_mode = options.get('scan') or SCAN_MODE
+        if scan_mode not in SCAN_MODES:
+            scan_mode = 'full'
+        job['scan_mode'] = scan_mode
+        triage_score = float(options.get('triage_score') or TRIAGE_MIN_SCORE) if scan_mode == 'triage' else None
+        first_rate = ADAPTIVE_SPARSE_FPS if scan_mode == 'adaptive' else SAMPLE_FPS
+        step = sample_step(fps, first_rate)
+        estimated_samples = max(1, int(math.ceil(duration * first_rate))) if duration > 0 else 1
+        job['stage'] = 'sampling'
+        job['total'] = estimated_samples
+
+        thumb_dir = os.path.join(out_dir, 'thumbs')
+        Path(thumb_dir).mkdir(parents=True, exist_ok=True)
+
+        samples_done = 0
+        frames_skipped = 0
+        frames_cached = 0
+        progress_lock = threading.Lock()
+
+        def on_sample(source='model'):
+            nonlocal samples_done, frames_skipped, frames_cached
+            with progress_lock:
+                samples_done += 1
+                job['processed'] = samples_done
+                if source == 'gate':
+                    frames_skipped += 1
+                    job['frames_skipped'] = frames_skipped
+                elif source == 'cache':
+                    frames_cached += 1
+                    job['frames_cached'] = frames_cached
+                try:
+                    elapsed = time.time() - start_time
+                    pct = float(samples_done) / float(max(1, job.get('total', 1)))
+                    eta = (elapsed / max(1e-6, pct) - elapsed) if pct > 0 else None
+                    job.update({'percent': round(pct * 100, 1), 'elapsed': elapsed, 'eta': eta})
+                except Exception:
+                    pass
+
+        # thumbnail-sized frames with the highest score seen so far, kept in memory to write the _best.jpg
+        best_score = None
+        best_frames = {}
+
+        def on_hit(fidx, score, frame):
+            nonlocal best_score, best_frames
+            with progress_lock:
+                if best_score is None or score > best_score:
+                    best_score, best_frames = score, {fidx: frame}
+                elif score == best_score:
+                    best_frames[fidx] = frame
+
+        checkpoint = None
+
+        def scan_ranges(ranges, range_step, follow_upload=False):
+            if len(ranges) == 1:
+                r0, r1 = ranges[0]
+                return list(scan_frame_range(video_path, video_id, fps, range_step, r0, r1, thumb_dir, on_sample, sampling_mode, on_hit, follow_upload, stats, checkpoint,
+                                             stop_score=triage_score))
+            with ThreadPoolExecutor(max_workers=min(len(ranges), max(1, SEGMENT_SCAN_WORKERS))) as ex:
+                futures = [ex.submit(scan_frame_range, video_path, video_id, fps, range_step, r0, r1, thumb_dir, on_sample, sampling_mode, on_hit, False, stats, checkpoint,
+                                     stop_score=triage_score) for r0, r1 in ranges]
+                return [rec for fut in futures for rec in fut.result()]
+
+        # a chunked upload that is still arriving is read front to back as it grows
+        streaming = bool(options.get('streaming')) and upload_in_progress(video_id)
+        job['streaming'] = streaming
+        ranges = [(0, None)]
+        if not streaming and scan_mode != 'triage' and SEGMENT_SCAN_WORKERS > 1 and duration >= SEGMENT_SCAN_MIN_DURATION:
+            ranges = split_frame_ranges(frame_count, step, SEGMENT_SCAN_WORKERS)
+        if len(ranges) > 1:
+            job['ranges'] = len(ranges)
+
+        # a file that is still growing has nothing stable to resume against, and triage is short
+        if CHECKPOINT_INTERVAL > 0 and not streaming and scan_mode != 'triage':
+            st = os.stat(video_path)
+            signature = {'size': st.st_size, 'mtime': st.st_mtime, 'frames': frame_count, 'fps': fps, 'sampling_mode': sampling_mode,
+                         'scan_mode': scan_mode, 'step': step, 'ranges': ranges, 'score_threshold': SCORE_THRESHOLD}
+            checkpoint = ScanCheckpoint(os.path.join(out_dir, 'checkpoints'), job_id, signature,
+                                        lambda: {'frames_sampled': samples_done, 'frames_skipped': frames_skipped, 'frames_cached': frames_cached},
+                                        video_id)
+            if checkpoint.restored:
+                samples_done = int(checkpoint.restored.get('frames_sampled', 0))
+                frames_skipped = int(checkpoint.restored.get('frames_skipped', 0))
+                frames_cached = int(checkpoint.restored.get('frames_cached', 0))
+                job.update({'processed': samples_done, 'frames_skipped': frames_skipped, 'frames_cached': frames_cached, 'resumed_at': samples_done})
+        if scan_mode == 'triage' and not streaming and frame_count > 0:
+            # the whole SAMPLE_FPS grid, spread over the timeline first
+            grid = range(0, frame_count, step)
+            targets = [grid[i] for i in coarse_to_fine(len(grid))]
+            job['total'] = len(targets)
+            results = scan_frame_range(video_path, video_id, fps, step, 0, None, thumb_dir, on_sample, sampling_mode, on_hit, stats=stats,
+                                       frames=iter_frames_at(video_path, fps, targets, sampling_mode), stop_score=triage_score)
+            results.sort(key=lambda r: r['frame_index'])
+        else:
+            # a triage of an upload still arriving reads it front to back and stops just the same
+            results = scan_ranges(ranges, step, streaming)
+        flagged = triage_score is not None and any(r['score'] >= triage_score for r in results)
+
+        if scan_mode == 'adaptive' and results:
+            # second pass: sample densely only around the frames the sparse pass flagged
+            dense_step = sample_step(fps, ADAPTIVE_DENSE_FPS)
+            windows = hit_windows([r['frame_index'] for r in results], int(round(ADAPTIVE_WINDOW * fps)), frame_count)
+            job['stage'] = 'refining'
+            job['total'] = samples_done + sum(max(1, (b - a) // dense_step) for a, b in windows)
+            sparse_frames = set(range(0, frame_count + 1, step)) if frame_count > 0 else set()
+            dense = [r for r in scan_ranges(windows, dense_step) if r['frame_index'] not in sparse_frames]
+            results = sorted(results + dense, key=lambda r: r['frame_index'])
+
+        scan_time = time.time() - start_time
+
+        # pick best thumbnail, written straight from the frame kept in memory
+        best_thumb = ''
+        if results:
+            best = max(results, key=lambda r: r.get('score', 0.0))
+            frame = best_frames.get(best.get('frame_index'))
+            if frame is not None:
+                best_thumb = f"{video_id}_best.jpg"
+                THUMB_WRITER.submit(os.path.join(out_dir, best_thumb), frame, video_id, stats)
+            else:
+                best_thumb = best.get('thumbnail','')
+        best_frames = {}
+
+        # SFW fallback: first frame
+        if not results:
+            try:
+                cap2 = cv2.VideoCapture(video_path)
+                if cap2.isOpened():
+                    cap2.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    ok, f0 = cap2.read()
+                    if ok and f0 is not None:
+                        THUMB_WRITER.submit(os.path.join(thumb_dir, f"{video_id}_f0.jpg"), f0, video_id)
+                        best_thumb = f"{video_id}_best.jpg"
+                        THUMB_WRITER.submit(os.path.join(out_dir, best_thumb), f0, video_id)
+                    cap2.release()
+            except Exception:
+                pass
+        job['stage'] = 'writing thumbnails'
+        THUMB_WRITER.wait(video_id)
+
+        # merge segments
+        try:
+            with stats.timed('merge'):
+                segments = merge_segments(results)
+        except Exception:
+            segments = []
+
+        # body type: once per segment on its best frame, or later when the report is viewed
+        # (always for triage, which only has to answer yes or no)
+        if BODY_TYPE_MODE == 'segment' and scan_mode != 'triage':
+            job['stage'] = 'classifying'
+            classify_segments(video_path, segments, stats)
+            apply_segment_body_types(results, segments)
+
+        # sprite sheet of the segment thumbnails and a score heatmap, one request each for the viewer
+        sprite = None
+        heatmap_file = f"{video_id}_heatmap.json"
+        try:
+            with stats.timed('sprite'):
+                sprite = write_sprite(os.path.join(out_dir, f"{video_id}_sprite.jpg"),
+                                      [(sg['thumbnail'], os.path.join(out_dir, sg['thumbnail'])) for sg in segments if sg.get('thumbnail')])
+                with open(os.path.join(out_dir, heatmap_file), 'w', encoding='utf-8') as fh:
+                    json.dump(score_heatmap(results, duration), fh)
+        except Exception:
+            heatmap_file = ''
+
+        # write report
+        report = {
+            'video': original_filename,
+            'video_id': video_id,
+            'duration': duration,
+            'fps': fps,
+            'sampling_mode': sampling_mode,
+            'scan_mode': scan_mode,
+            'sha256': options.get('sha256') or (_file_sha256(video_path) if streaming else ''),
+            'frames_sampled': samples_done,
+            'frames_skipped': frames_skipped,
+            'frames_cached': frames_cached,
+            'detections': results,
+            'best_thumbnail': best_thumb,
+            'segments': segments,
+            'merge_gap': MERGE_GAP,
+            'sprite': sprite,
+            'heatmap_file': heatmap_file,
+            # triage stopped at a hit, so the detections cover only part of the video
+            'partial': flagged,
+            'scan_time': scan_time,
+            # timings up to here; the report write itself is only counted on /metrics
+            'profile': stats.to_dict(),
+        }
+        if triage_score is not None:
+            report['triage'] = {'min_score': triage_score, 'flagged': flagged}
+        try:
+            report_path = report_io.report_path(out_dir, video_id)
+            with stats.timed('report_write'):
+                header = report_io.write_report(report_path, report)
+                if store:
+                    store_report(header, report_mtime=os.path.getmtime(report_path))
+            if checkpoint is not None:
+                checkpoint.discard()
+        except Exception:
+            pass
+
+        # finalize job
+        view_t = segments[0].get('start', 0) if segments else (results[0].get('timestamp', 0) if results else 0)
+        job.update({'state': 'done', 'percent': 100.0, 'view': f'/view/{video_id}?t={view_t}', 'scan_time': scan_time})
+        if triage_score is not None:
+            job['flagged'] = flagged
+        stats.count('jobs_done')
+        stats.count('scan_seconds', scan_time)
+        stats.count('video_seconds', duration)
+
+    except Exception as e:
+        job.update({'state': 'error', 'error': str(e)})
+        stats.count('jobs_failed')
+    finally:
+        with JOBS_LOCK:
+            JOBS[job_id] = job
+            _job_changed(job_id)
+    return stats.to_dict()
+
+
+def _save_queue():
+    """Persist SCAN_QUEUE to disk. Caller must hold SCAN_QUEUE_COND."""
+    tmp = QUEUE_FILE + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(SCAN_QUEUE, fh, indent=2)
+        os.replace(tmp, QUEUE_FILE)
+    except Exception:
+        pass
+
+
+def _queued_job_state(position):
+    return {'state': 'queued', 'stage': 'queued', 'percent': 0.0, 'processed': 0, 'total': 0, 'start_time': time.time(), 'queue_position': position}
+
+
+def queue_position(job_id):
+    """1-based position of a job among those still waiting, or None if it is not waiting."""
+    with SCAN_QUEUE_COND:
+        pos = 0
+        for e in SCAN_QUEUE:
+            if e.get('state') != 'queued':
+                continue
+            pos += 1
+            if e.get('job_id') == job_id:
+                return pos
+    return None
+
+
+def enqueue_job(video_id, original_filename, video_path, job_id, options=None, task=None, first=False):
+    """Queue a scan (or, with `task`, another job run by the scan workers); `first` puts it ahead
+    of every job still waiting."""
+    entry = {'job_id': job_id, 'video_id': video_id, 'original': original_filename, 'video_path': video_path, 'options': options or {}, 'state': 'queued', 'queued_at': time.time()}
+    if task:
+        entry['task'] = task
+    # load the persisted queue before saving it with this entry added
+    start_scheduler()
+    with SCAN_QUEUE_COND:
+        if first:
+            at = next((i for i, e in enumerate(SCAN_QUEUE) if e.get('state') == 'queued'), len(SCAN_QUEUE))
+            SCAN_QUEUE.insert(at, entry)
+            _queue_moved()
+        else:
+            SCAN_QUEUE.append(entry)
+        _save_queue()
+        position = queue_position(job_id)
+        with JOBS_LOCK:
+            JOBS[job_id] = _queued_job_state(position)
+            _job_changed(job_id)
+        SCAN_QUEUE_COND.notify()
+    return entry
+
+
+def queue_classify(video_id):
+    """Queue classify_report_job for a report with pending segments, unless it is queued already."""
+    job_id = f"{video_id}_classify"
+    with SCAN_QUEUE_COND:
+        if any(e.get('job_id') == job_id for e in SCAN_QUEUE):
+            return job_id
+        enqueue_job(video_id, '', os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4"), job_id, task='classify', first=True)
+    return job_id
+
+
+def set_queued_option(video_id, key, value):
+    """Set a scan option on a job that is still queued or running (e.g. a hash known only later)."""
+    with SCAN_QUEUE_COND:
+        for e in SCAN_QUEUE:
+            if e.get('video_id') == video_id:
+                e.setdefault('options', {})[key] = value
+                _save_queue()
+                return True
+    return False
+
+
+def _queue_moved():
+    """Wake waiters of jobs still queued, whose positions just changed. Caller must hold SCAN_QUEUE_COND."""
+    with JOBS_LOCK:
+        for e in SCAN_QUEUE:
+            if e.get('state') == 'queued' and e.get('job_id') in JOBS:
+                _job_changed(e['job_id'])
+
+
+def cancel_queued(video_id):
+    """Drop a job that has not started yet. Returns True if one was removed."""
+    with SCAN_QUEUE_COND:
+        for e in list(SCAN_QUEUE):
+            if e.get('video_id') == video_id and e.get('state') == 'queued':
+                SCAN_QUEUE.remove(e)
+                _save_queue()
+                with JOBS_LOCK:
+                    JOBS.pop(e.get('job_id'), None)
+                    _job_changed(e.get('job_id'))
+                _queue_moved()
+                return True
+    return False
+
+
+def _init_scan_process(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    start_model_loading()
+
+
+def _warm_scan_pool():
+    """Have the scan processes load their models now rather than on the first job."""
+    global SCAN_MODELS_STATE
+    try:
+        pool = _get_scan_pool()
+    except Exception:
+        start_model_loading()
+        return
+
+    def done(fut):
+        global SCAN_MODELS_STATE
+        try:
+            SCAN_MODELS_STATE = fut.result()
+        except Exception as e:
+            SCAN_MODELS_STATE = {'state': 'error', 'error': str(e)}
+    SCAN_MODELS_STATE = {'state': 'loading', 'started': time.time()}
+    pool.submit(ensure_models).add_done_callback(done)
+
+
+def _apply_progress(progress_queue):
+    """Copy job updates coming from scan processes into JOBS."""
+    while True:
+        try:
+            kind, job_id, changes = progress_queue.get()
+        except (EOFError, OSError):
+            return
+        except Exception:
+            continue
+        with JOBS_LOCK:
+            if kind == 'set' or job_id not in JOBS:
+                JOBS[job_id] = dict(changes)
+            else:
+                JOBS[job_id].update(changes)
+            _job_changed(job_id)
+
+
+def _get_scan_pool():
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is None:
+            ctx = multiprocessing.get_context('spawn')
+            progress_queue = ctx.Queue()
+            _scan_pool = ProcessPoolExecutor(max_workers=max(1, int(SCAN_WORKERS)), mp_context=ctx,
+                                             initializer=_init_scan_process, initargs=(progress_queue,))
+            threading.Thread(target=_apply_progress, args=(progress_queue,), daemon=True).start()
+        return _scan_pool
+
+
+def _run_scan(entry):
+    run, args = process_video_job, (entry['video_id'], entry['original'], entry['video_path'], entry['job_id'], entry.get('options') or {})
+    if entry.get('task') == 'classify':
+        run, args = classify_report_job, (entry['video_id'], entry['job_id'])
+    if SCAN_ENGINE != 'process':
+        METRICS.merge(run(*args))
+        return
+    global _scan_pool
+    try:
+        pool = _get_scan_pool()
+    except Exception:
+        # no process support on this host; scan in this process instead
+        METRICS.merge(run(*args))
+        return
+    try:
+        METRICS.merge(pool.submit(run, *args).result())
+    except BrokenProcessPool:
+        METRICS.count('jobs_failed')
+        with _scan_pool_lock:
+            if _scan_pool is pool:
+                _scan_pool = None
+        with JOBS_LOCK:
+            JOBS[entry['job_id']] = {'state': 'error', 'error': 'scan process crashed'}
+            _job_changed(entry['job_id'])
+
+
+def _scan_worker():
+    while True:
+        with SCAN_QUEUE_COND:
+            while True:
+                entry = next((e for e in SCAN_QUEUE if e.get('state') == 'queued'), None)
+                if entry is not None:
+                    break
+                SCAN_QUEUE_COND.wait()
+            entry['state'] = 'running'
+            _save_queue()
+            _queue_moved()
+        try:
+            _run_scan(entry)
+            sha = (entry.get('options') or {}).get('sha256')
+            if sha and os.path.exists(report_io.report_path(UPLOAD_FOLDER, entry['video_id'])):
+                record_content_hash(sha, entry['video_id'])
+        except Exception:
+            pass
+        finally:
+            with SCAN_QUEUE_COND:
+                if entry in SCAN_QUEUE:
+                    SCAN_QUEUE.remove(entry)
+                _save_queue()
+                # a scan that gave up on a stalled upload which has been finished since: scan the
+                # whole file (upload_finish queues it when it comes after this)
+                options = entry.get('options') or {}
+                if (options.get('streaming') and not upload_in_progress(entry['video_id']) and os.path.exists(entry['video_path'])
+                        and not os.path.exists(report_io.report_path(UPLOAD_FOLDER, entry['video_id']))):
+                    enqueue_job(entry['video_id'], entry['original'], entry['video_path'], entry['job_id'], dict(options, streaming=False))
+
+
+def start_scheduler():
+    """Reload the persisted queue and start the scan workers (once per process)."""
+    global _scheduler_started
+    with SCAN_QUEUE_COND:
+        if _scheduler_started:
+            return
+        _scheduler_started = True
+        saved = []
+        try:
+            with open(QUEUE_FILE, 'r', encoding='utf-8') as fh:
+                saved = json.load(fh) or []
+        except Exception:
+            saved = []
+        # jobs that were running when the process stopped are scanned again, ahead of the rest
+        saved.sort(key=lambda e: 0 if e.get('state') == 'running' else 1)
+        queued_ids = {e.get('job_id') for e in SCAN_QUEUE}
+        for e in saved:
+            if not e.get('job_id') or not os.path.exists(e.get('video_path', '')):
+                continue
+            if e['job_id'] in queued_ids:
+                continue
+            e['state'] = 'queued'
+            SCAN_QUEUE.append(e)
+            with JOBS_LOCK:
+                JOBS[e['job_id']] = _queued_job_state(len(SCAN_QUEUE))
+                _job_changed(e['job_id'])
+        _save_queue()
+    for _ in range(max(1, int(SCAN_WORKERS))):
+        threading.Thread(target=_scan_worker, daemon=True).start()
+    if SCAN_ENGINE == 'process':
+        _warm_scan_pool()
+    else:
+        start_model_loading()
+
+
+def save_upload(f, video_path):
+    """Stream an uploaded file to disk and return its SHA-256 hex digest."""
+    h = hashlib.sha256()
+    with open(video_path, 'wb') as out:
+        while True:
+            chunk = f.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            out.write(chunk)
+    return h.hexdigest()
+
+
+HASH_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (sha TEXT PRIMARY KEY, video_id TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS hashes_video_id ON hashes (video_id);
+"""
+
+
+def _hash_index_conn():
+    """Connection to the hash index, importing the legacy JSON index once per process."""
+    global _hash_index_imported
+    conn = _db_conn(HASH_INDEX_FILE, HASH_INDEX_SCHEMA)
+    with _hash_index_import_lock:
+        if not _hash_index_imported:
+            _hash_index_imported = True
+            legacy = os.path.join(os.path.dirname(HASH_INDEX_FILE), 'hash_index.json')
+            try:
+                with open(legacy, 'r', encoding='utf-8') as fh:
+                    index = json.load(fh)
+                # existing rows are newer than the JSON file
+                conn.executemany('INSERT OR IGNORE INTO hashes (sha, video_id) VALUES (?, ?)', list(index.items()))
+                conn.commit()
+                os.replace(legacy, legacy + '.imported')
+            except Exception:
+                pass
+    return conn
+
+
+def record_content_hash(sha, video_id):
+    try:
+        conn = _hash_index_conn()
+        conn.execute('INSERT OR REPLACE INTO hashes (sha, video_id) VALUES (?, ?)', (sha, video_id))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def forget_content_hashes(video_id):
+    try:
+        conn = _hash_index_conn()
+        conn.execute('DELETE FROM hashes WHERE video_id = ?', (video_id,))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def find_duplicate(sha, partial_ok=True):
+    """video_id of an earlier upload with the same content that is scanned or still being scanned.
+
+    Without `partial_ok` triage scans (finished or queued) do not count, as they may have
+    stopped early.
+    """
+    try:
+        row = _hash_index_conn().execute('SELECT video_id FROM hashes WHERE sha = ?', (sha,)).fetchone()
+    except Exception:
+        row = None
+    video_id = row[0] if row else None
+    if video_id:
+        try:
+            report = report_io.read_report(report_io.report_path(UPLOAD_FOLDER, video_id))
+            if partial_ok or not report.get('partial'):
+                return video_id
+        except Exception:
+            pass
+    with SCAN_QUEUE_COND:
+        for e in SCAN_QUEUE:
+            options = e.get('options') or {}
+            if options.get('sha256') == sha and (partial_ok or options.get('scan') != 'triage'):
+                return e.get('video_id')
+    return None
+
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    video_id TEXT PRIMARY KEY,
+    video_name TEXT,
+    first_ts REAL,
+    thumb TEXT,
+    tags TEXT,
+    scan_time REAL,
+    scanned_at REAL,
+    report_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS reports_scanned_at ON reports (scanned_at);
+"""
+
+_library_synced = False
+_library_sync_lock = threading.Lock()
+
+
+def report_summary(rep):
+    """Card fields shown on the index page for one report (a header or an old inline report)."""
+    dets = rep.get('detections', [])
+    segs = rep.get('segments', [])
+    if segs:
+        first_ts = segs[0].get('start', 0)
+    elif 'first_detection' in rep:
+        first_ts = rep.get('first_detection') or 0
+    else:
+        first_ts = dets[0].get('timestamp') if dets else 0
+    thumb = rep.get('best_thumbnail') or ''
+    if thumb:
+        thumb = thumb.replace('\\','/').lstrip('/')
+    tags = []
+    freq = rep.get('detection_classes')
+    if freq is None and dets:
+        freq = {}
+        for d in dets:
+            cls = d.get('class')
+            if cls:
+                freq[cls] = freq.get(cls, 0) + 1
+    if freq:
+        tags = sorted(freq.keys(), key=lambda k: -freq[k])
+    else:
+        tags = ['SAFE']
+    return {'video_id': rep.get('video_id'), 'video_name': rep.get('video'), 'first_ts': first_ts, 'thumb': thumb, 'tags': tags, 'scan_time': rep.get('scan_time', 0)}
+
+
+def store_report(rep, report_mtime=None, scanned_at=None):
+    """Insert or refresh the library row for a report."""
+    c = report_summary(rep)
+    if not c['video_id']:
+        return
+    now = time.time()
+    try:
+        conn = _db_conn(LIBRARY_DB, LIBRARY_SCHEMA)
+        conn.execute('INSERT OR REPLACE INTO reports (video_id, video_name, first_ts, thumb, tags, scan_time, scanned_at, report_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (c['video_id'], c['video_name'], float(c['first_ts'] or 0), c['thumb'], json.dumps(c['tags']), float(c['scan_time'] or 0),
+                      scanned_at or now, report_mtime or now))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def unstore_report(video_id):
+    try:
+        conn = _db_conn(LIBRARY_DB, LIBRARY_SCHEMA)
+        conn.execute('DELETE FROM reports WHERE video_id = ?', (video_id,))
+        conn.commit()
+    except Exception:
+        pass
+
+
+def sync_report_store():
+    """Index reports written or edited outside the app (e.g. by scripts/); runs once per process."""
+    global _library_synced
+    with _library_sync_lock:
+        if _library_synced:
+            return
+        _library_synced = True
+        try:
+            conn = _db_conn(LIBRARY_DB, LIBRARY_SCHEMA)
+            known = dict(conn.execute('SELECT video_id, report_mtime FROM reports').fetchall())
+        except Exception:
+            return
+        on_disk = set()
+        for p in Path(UPLOAD_FOLDER).glob('*' + report_io.REPORT_SUFFIX):
+            video_id = p.name[:-len(report_io.REPORT_SUFFIX)]
+            on_disk.add(video_id)
+            try:
+                mtime = p.stat().st_mtime
+                if known.get(video_id) is not None and known[video_id] >= mtime:
+                    continue
+                with open(p, 'r', encoding='utf-8') as fh:
+                    store_report(json.load(fh), report_mtime=mtime, scanned_at=mtime)
+            except Exception:
+                continue
+        for video_id in set(known) - on_disk:
+            unstore_report(video_id)
+
+
+def list_reports(page=1, per_page=None):
+    """One page of library cards, newest first. Returns (cards, total)."""
+    sync_report_store()
+    per_page = per_page or PAGE_SIZE
+    page = max(1, int(page))
+    try:
+        conn = _db_conn(LIBRARY_DB, LIBRARY_SCHEMA)
+        total = conn.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+        rows = conn.execute('SELECT video_id, video_name, first_ts, thumb, tags, scan_time FROM reports ORDER BY scanned_at DESC LIMIT ? OFFSET ?',
+                            (per_page, (page - 1) * per_page)).fetchall()
+    except Exception:
+        return [], 0
+    cards = [{'video_id': r[0], 'video_name': r[1], 'first_ts': r[2], 'thumb': r[3] or '', 'tags': json.loads(r[4] or '[]'), 'scan_time': r[5]} for r in rows]
+    return cards, total
+
+
+def scan_options_from_form(form):
+    """Per-job scan options from upload form fields. Returns (options, error)."""
+    options = {}
+    sampling = form.get('sampling')
+    if sampling:
+        if sampling not in SAMPLING_MODES:
+            return None, f'unknown sampling mode: {sampling}'
+        options['sampling'] = sampling
+    scan = form.get('scan')
+    if scan:
+        if scan not in SCAN_MODES:
+            return None, f'unknown scan mode: {scan}'
+        options['scan'] = scan
+    triage_score = form.get('triage_score')
+    if triage_score:
+        try:
+            triage_score = float(triage_score)
+        except ValueError:
+            return None, f'bad triage score: {triage_score}'
+        if not 0.0 < triage_score <= 1.0:
+            return None, 'triage score must be in (0, 1]'
+        options['triage_score'] = triage_score
+    return options, None
+
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    if request.method == 'GET':
+        try:
+            page = max(1, int(request.args.get('page', 1)))
+        except ValueError:
+            page = 1
+        cards, total = list_reports(page)
+        pages = max(1, int(math.ceil(total / float(PAGE_SIZE))))
+        return render_template_string(INDEX_HTML, cards=cards, page=page, pages=pages, total=total, format_time=format_time, triage_score=TRIAGE_MIN_SCORE)
+
+    # POST: upload file -> queue a background scan
+    f = request.files.get('video')
+    if not f or f.filename == '':
+        return jsonify({'ok': False, 'error': 'no file'}), 400
+    options, error = scan_options_from_form(request.form)
+    if error:
+        return jsonify({'ok': False, 'error': error}), 400
+    original = f.filename
+    video_id = str(uuid.uuid4())
+    video_path = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
+    sha = save_upload(f, video_path)
+    return jsonify(queue_upload(video_id, original, video_path, options, sha)), 200
+
+
+def queue_upload(video_id, original, video_path, options, sha):
+    """Queue a fully received upload for scanning, or link it to an identical earlier one."""
+    # identical file already scanned (or queued): link to that report instead of scanning again
+    existing = find_duplicate(sha, partial_ok=options.get('scan') == 'triage')
+    if existing:
+        try:
+            os.remove(video_path)
+        except Exception:
+            pass
+        return {'ok': True, 'job': existing, 'view': f'/view/{existing}', 'duplicate_of': existing}
+    options['sha256'] = sha
+
+    job_id = video_id
+    enqueue_job(video_id, original, video_path, job_id, options)
+    return {'ok': True, 'job': job_id, 'view': f'/view/{video_id}'}
+
+
+def mp4_streamable(path, received):
+    """Whether an MP4 can be scanned before it is complete, from its first `received` bytes.
+
+    True for fast-start (moov before mdat) and fragmented (moof) files, False when mdat comes
+    first or the file is not MP4, None while the answer is not in the received bytes yet.
+    """
+    pos = 0
+    seen_moov = False
+    with open(path, 'rb') as fh:
+        while pos + 8 <= received:
+            fh.seek(pos)
+            hdr = fh.read(16)
+            size = int.from_bytes(hdr[:4], 'big')
+            kind = hdr[4:8]
+            if pos == 0 and kind != b'ftyp':
+                return False
+            if size == 1:
+                if len(hdr) < 16:
+                    return None
+                size = int.from_bytes(hdr[8:16], 'big')
+            elif size == 0:
+                size = received - pos
+            if size < 8:
+                return False
+            if kind == b'moov':
+                if pos + size > received:
+                    return None
+                seen_moov = True
+            elif kind in (b'moof', b'mdat'):
+                return seen_moov
+            pos += size
+    return None
+
+
+def _load_upload_meta(video_id):
+    try:
+        with open(_upload_meta_path(os.path.basename(video_id)), 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except Exception:
+        return None
+
+
+def _save_upload_meta(meta):
+    path = _upload_meta_path(meta['video_id'])
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(meta, fh, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(UPLOAD_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@app.route('/upload/start', methods=['POST'])
+def upload_start():
+    """Open a chunked upload. Form fields: filename, size (bytes) and the usual scan options."""
+    options, error = scan_options_from_form(request.form)
+    if error:
+        return jsonify({'ok': False, 'error': error}), 400
+    try:
+        size = int(request.form.get('size') or 0)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'bad size'}), 400
+    video_id = str(uuid.uuid4())
+    open(os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4"), 'wb').close()
+    meta = {'video_id': video_id, 'filename': request.form.get('filename') or f"{video_id}.mp4", 'size': size,
+            'options': options, 'streamable': None, 'scan_started': False, 'created': time.time()}
+    _save_upload_meta(meta)
+    with UPLOAD_SESSIONS_LOCK:
+        UPLOAD_SESSIONS[video_id] = {'hasher': hashlib.sha256(), 'hashed': 0}
+        UPLOAD_LOCKS[video_id] = threading.Lock()
+    return jsonify({'ok': True, 'upload_id': video_id, 'chunk_size': UPLOAD_CHUNK_SIZE})
+
+
+@app.route('/upload/<video_id>', methods=['GET'])
+def upload_state(video_id):
+    """How many bytes the server has, so an interrupted client can resume from there."""
+    meta = _load_upload_meta(video_id)
+    if not meta:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    received = os.path.getsize(os.path.join(UPLOAD_FOLDER, f"{meta['video_id']}.mp4"))
+    return jsonify({'ok': True, 'received': received, 'size': meta.get('size', 0), 'scan_started': meta.get('scan_started', False)})
+
+
+def _upload_lock(video_id):
+    with UPLOAD_SESSIONS_LOCK:
+        return UPLOAD_LOCKS.setdefault(video_id, threading.Lock())
+
+
+@app.route('/upload/<video_id>', methods=['PUT'])
+def upload_chunk(video_id):
+    """Append the request body at ?offset=N, which must equal the bytes received so far."""
+    meta = _load_upload_meta(video_id)
+    if not meta:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    video_id = meta['video_id']
+    video_path = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
+    with _upload_lock(video_id):
+        # finished or deleted while this request waited for the lock
+        if not upload_in_progress(video_id):
+            return jsonify({'ok': False, 'error': 'not found'}), 404
+        received = os.path.getsize(video_path)
+        try:
+            offset = int(request.args.get('offset', received))
+        except ValueError:
+            offset = -1
+        if offset != received:
+            return jsonify({'ok': False, 'error': 'offset mismatch', 'received': received}), 409
+        with UPLOAD_SESSIONS_LOCK:
+            session = UPLOAD_SESSIONS.get(video_id)
+        with open(video_path, 'ab') as out:
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                if session is not None and session['hashed'] == received:
+                    session['hasher'].update(chunk)
+                    session['hashed'] += len(chunk)
+                received += len(chunk)
+
+        # start scanning early when the container allows reading it front to back
+        if not meta.get('scan_started') and meta.get('streamable') is None and received >= EARLY_SCAN_MIN_BYTES:
+            try:
+                meta['streamable'] = mp4_streamable(video_path, received)
+            except Exception:
+                meta['streamable'] = False
+            if meta['streamable']:
+                meta['scan_started'] = True
+                options = dict(meta.get('options') or {}, streaming=True)
+                enqueue_job(video_id, meta['filename'], video_path, video_id, options)
+            if meta['streamable'] is not None:
+                _save_upload_meta(meta)
+    return jsonify({'ok': True, 'received': received, 'scan_started': meta.get('scan_started', False)})
+
+
+@app.route('/upload/<video_id>/finish', methods=['POST'])
+def upload_finish(video_id):
+    meta = _load_upload_meta(video_id)
+    if not meta:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    video_id = meta['video_id']
+    video_path = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
+    with _upload_lock(video_id):
+        if not upload_in_progress(video_id):
+            return jsonify({'ok': False, 'error': 'not found'}), 404
+        received = os.path.getsize(video_path)
+        if meta.get('size') and received < meta['size']:
+            return jsonify({'ok': False, 'error': 'upload incomplete', 'received': received}), 409
+        with UPLOAD_SESSIONS_LOCK:
+            session = UPLOAD_SESSIONS.pop(video_id, None)
+            UPLOAD_LOCKS.pop(video_id, None)
+        if session is not None and session['hashed'] == received:
+            sha = session['hasher'].hexdigest()
+        else:
+            sha = _file_sha256(video_path)
+        # removing the marker tells a scan that is following the upload that the file is complete
+        try:
+            os.remove(_upload_meta_path(video_id))
+        except Exception:
+            pass
+    # the scan following the upload reads it to the end, unless it already gave up on a stall
+    if meta.get('scan_started') and (set_queued_option(video_id, 'sha256', sha)
+                                     or os.path.exists(report_io.report_path(UPLOAD_FOLDER, video_id))):
+        return jsonify({'ok': True, 'job': video_id, 'view': f'/view/{video_id}'}), 200
+    return jsonify(queue_upload(video_id, meta['filename'], video_path, dict(meta.get('options') or {}), sha)), 200
+
+
+_push_lock = threading.Lock()
+_push_open = 0
+# limit derived from the request threads by run_server(); PUSH_MAX_CONNECTIONS overrides it
+_push_limit = None
+
+
+def _open_push():
+    """Take a push connection slot; False when all are in use."""
+    global _push_open
+    limit = PUSH_MAX_CONNECTIONS if PUSH_MAX_CONNECTIONS is not None else _push_limit
+    with _push_lock:
+        if limit is not None and _push_open >= limit:
+            return False
+        _push_open += 1
+        return True
+
+
+def _close_push():
+    global _push_open
+    with _push_lock:
+        _push_open = max(0, _push_open - 1)
+
+
+def job_status(job_id):
+    """Snapshot of a job for the client, or None if unknown."""
+    with JOBS_LOCK:
+        j = JOBS.get(job_id)
+        if not j:
+            return None
+        out = dict(j)
+    if out.get('state') == 'queued':
+        out['queue_position'] = queue_position(job_id)
+    eta = out.get('eta')
+    if eta is not None:
+        out['eta_readable'] = f"{int(eta//60)}m {int(eta%60)}s"
+    return out
+
+
+def wait_for_jobs(job_ids, since, timeout):
+    """Block until one of job_ids changed after version `since` (or timeout). Returns {job_id: version}.
+
+    With no job_ids any job counts.
+    """
+    deadline = time.time() + timeout
+    with JOBS_CHANGED:
+        while True:
+            ids = job_ids or list(JOB_VERSIONS)
+            changed = {j: JOB_VERSIONS[j] for j in ids if JOB_VERSIONS.get(j, 0) > since}
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed
+            JOBS_CHANGED.wait(remaining)
+
+
+@app.route('/status/<job_id>')
+def status(job_id):
+    """Job progress. With ?wait=N, hold the request up to N seconds until the job changes after
+    version ?since=V (the `version` of the previous answer)."""
+    try:
+        wait = min(float(request.args.get('wait', 0)), STATUS_MAX_WAIT)
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        wait, since = 0, 0
+    if wait > 0 and job_id in JOBS:
+        if not _open_push():
+            return jsonify({'ok': False, 'error': 'busy, poll without ?wait='}), 503, {'Retry-After': '2'}
+        try:
+            wait_for_jobs([job_id], since, wait)
+        finally:
+            _close_push()
+    with JOBS_LOCK:
+        version = JOB_VERSIONS.get(job_id, 0)
+    out = job_status(job_id)
+    if out is None:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    return jsonify({'ok': True, 'status': out, 'version': version})
+
+
+@app.route('/events')
+def events():
+    """Server-sent progress events for ?jobs=id1,id2 (every job when omitted).
+
+    Each message is a `status` event carrying {job, status} for a job that changed; the stream
+    ends once every listed job is done, failed or gone, and otherwise after STATUS_MAX_WAIT
+    seconds, when the browser reconnects and carries on from Last-Event-ID.
+    """
+    if not _open_push():
+        return Response('too many open event streams\n', status=503, mimetype='text/plain', headers={'Retry-After': '2'})
+    job_ids = [j for j in (request.args.get('jobs') or '').split(',') if j]
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since') or 0)
+    except ValueError:
+        since = 0
+
+    def finished():
+        return all((job_status(j) or {}).get('state', 'error') in ('done', 'error') for j in job_ids)
+
+    def stream():
+        last = since
+        deadline = time.time() + STATUS_MAX_WAIT
+        yield 'retry: 3000\n\n'
+        for job_id in job_ids:
+            if job_id not in JOBS:
+                yield f'event: status\ndata: {json.dumps({"job": job_id, "status": None})}\n\n'
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # free the thread; an id-only message moves Last-Event-ID on for the reconnect
+                if last:
+                    yield f'id: {last}\n\n'
+                return
+            changed = wait_for_jobs(job_ids, last, min(EVENTS_KEEPALIVE, remaining))
+            if not changed:
+                if job_ids and finished():
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            last = max(changed.values())
+            for job_id in sorted(changed, key=changed.get):
+                out = job_status(job_id)
+                data = json.dumps({'job': job_id, 'status': out}, default=_json_default)
+                yield f'id: {changed[job_id]}\nevent: status\ndata: {data}\n\n'
+            if job_ids and finished():
+                return
+            # coalesce bursts of per-frame updates
+            time.sleep(PROGRESS_MIN_INTERVAL)
+
+    resp = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    resp.call_on_close(_close_push)
+    return resp
+
+
+@app.route('/ready')
+def ready():
+    """200 once the models scans need are loaded (in the scan processes with that engine), else 503."""
+    if SCAN_ENGINE == 'process' and SCAN_MODELS_STATE is not None:
+        state = dict(SCAN_MODELS_STATE)
+    else:
+        start_model_loading()
+        state = dict(MODEL_STATE)
+    state['engine'] = SCAN_ENGINE
+    state['ready'] = state.get('state') == 'ready'
+    return jsonify(state), (200 if state['ready'] else 503)
+
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings, frame counters and queue sizes in the Prometheus text format."""
+    data = METRICS.to_dict()
+    lines = ['# HELP nudeid_stage_seconds Time spent per scan stage.', '# TYPE nudeid_stage_seconds histogram']
+    for stage, st in sorted(data['stages'].items()):
+        total = 0
+        for le, n in zip(STAGE_BUCKETS, st['buckets']):
+            total += n
+            lines.append(f'nudeid_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}')
+        lines.append(f'nudeid_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {st["count"]}')
+        lines.append(f'nudeid_stage_seconds_sum{{stage="{stage}"}} {st["sum"]:.6f}')
+        lines.append(f'nudeid_stage_seconds_count{{stage="{stage}"}} {st["count"]}')
+    counters = data['counters']
+    lines += ['# HELP nudeid_frames_total Sampled frames by outcome.', '# TYPE nudeid_frames_total counter']
+    for kind in ('sampled', 'detected', 'cached', 'skipped', 'hit'):
+        lines.append(f'nudeid_frames_total{{kind="{kind}"}} {counters.get("frames_" + kind, 0)}')
+    lines += ['# HELP nudeid_detections_total Detections above SCORE_THRESHOLD.', '# TYPE nudeid_detections_total counter',
+              f'nudeid_detections_total {counters.get("detections", 0)}']
+    lines += ['# HELP nudeid_jobs_total Finished scan jobs by result.', '# TYPE nudeid_jobs_total counter',
+              f'nudeid_jobs_total{{result="done"}} {counters.get("jobs_done", 0)}',
+              f'nudeid_jobs_total{{result="error"}} {counters.get("jobs_failed", 0)}']
+    lines += ['# HELP nudeid_scan_seconds_total Wall time of finished scans.', '# TYPE nudeid_scan_seconds_total counter',
+              f'nudeid_scan_seconds_total {counters.get("scan_seconds", 0.0):.3f}']
+    with SCAN_QUEUE_COND:
+        states = Counter(e.get('state') for e in SCAN_QUEUE)
+    lines += ['# HELP nudeid_queue_jobs Jobs waiting or running.', '# TYPE nudeid_queue_jobs gauge',
+              f'nudeid_queue_jobs{{state="queued"}} {states.get("queued", 0)}',
+              f'nudeid_queue_jobs{{state="running"}} {states.get("running", 0)}']
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/uploads/<path:filename>')
+def uploaded(filename):
+    """Videos and thumbnails, with Range / 206 and ETag / 304 support."""
+    cacheable = filename.lower().endswith('.jpg') and filename.replace('\\', '/').startswith('thumbs/')
+    if MEDIA_ACCEL_PREFIX:
+        path = safe_join(UPLOAD_FOLDER, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        resp.headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + filename.replace('\\', '/')
+    else:
+        resp = send_from_directory(UPLOAD_FOLDER, filename, max_age=THUMB_CACHE_MAX_AGE if cacheable else None)
+    if cacheable:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = THUMB_CACHE_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        # a rescan rewrites the _best.jpg and the sprite (with a new tile layout) under the same name
+        resp.cache_control.no_cache = True
+    return resp
+
+
+@app.route('/delete/<video_id>', methods=['POST'])
+def delete_video(video_id):
+    removed = []
+    errors = []
+    cancel_queued(video_id)
+    forget_content_hashes(video_id)
+    unstore_report(video_id)
+    try:
+        v = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
+        if os.path.exists(v):
+            os.remove(v); removed.append(v)
+        r = report_io.report_path(UPLOAD_FOLDER, video_id)
+        if os.path.exists(r):
+            os.remove(r); removed.append(r)
+        d = report_io.detections_path(r)
+        if os.path.exists(d):
+            os.remove(d); removed.append(d)
+        for name in (f"{video_id}_best.jpg", f"{video_id}_sprite.jpg", f"{video_id}_heatmap.json"):
+            b = os.path.join(UPLOAD_FOLDER, name)
+            if os.path.exists(b):
+                os.remove(b); removed.append(b)
+        u = _upload_meta_path(video_id)
+        if os.path.exists(u):
+            os.remove(u); removed.append(u)
+        removed.extend(remove_checkpoint(os.path.join(UPLOAD_FOLDER, 'checkpoints'), video_id))
+        with UPLOAD_SESSIONS_LOCK:
+            UPLOAD_SESSIONS.pop(video_id, None)
+            UPLOAD_LOCKS.pop(video_id, None)
+        tdir = os.path.join(UPLOAD_FOLDER, 'thumbs')
+        if os.path.isdir(tdir):
+            for p in Path(tdir).glob(f"{video_id}_f*.jpg"):
+                try:
+                    os.remove(str(p)); removed.append(str(p))
+                except Exception:
+                    errors.append(str(p))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    return jsonify({'ok': True, 'removed': removed, 'errors': errors})
+
+
+_DETECTIONS_CACHE = {}
+_DETECTIONS_CACHE_LOCK = threading.Lock()
+
+
+def load_detection_columns(video_id, report=None):
+    """Detection columns of a stored report (None without a report), cached by report mtime."""
+    path = report_io.report_path(UPLOAD_FOLDER, os.path.basename(video_id))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _DETECTIONS_CACHE_LOCK:
+        hit = _DETECTIONS_CACHE.get(path)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    try:
+        cols = report_io.read_columns(path, report)
+    except Exception:
+        return None
+    with _DETECTIONS_CACHE_LOCK:
+        _DETECTIONS_CACHE.pop(path, None)
+        _DETECTIONS_CACHE[path] = (mtime, cols)
+        while len(_DETECTIONS_CACHE) > max(0, DETECTIONS_CACHE_SIZE):
+            _DETECTIONS_CACHE.pop(next(iter(_DETECTIONS_CACHE)))
+    return cols
+
+
+def page_detections(cols, best='', start=None, end=None, classes=None, offset=0, limit=None):
+    """One page of detection dicts matching a time range / classes; returns (detections, total)."""
+    rows = report_io.select(cols, start, end, classes)
+    limit = DETECTIONS_PAGE_SIZE if limit is None else limit
+    dets = report_io.from_columns(cols, rows[offset:offset + limit])
+    for d in dets:
+        t = d.get('thumbnail','') or ''
+        d['thumbnail'] = t.replace('\\','/').lstrip('/') if t else best
+    return dets, len(rows)
+
+
+def _best_thumbnail(report):
+    best = report.get('best_thumbnail','')
+    return os.path.basename(best).replace('\\','/') if best else ''
+
+
+@app.route('/detections/<video_id>')
+def detections(video_id):
+    """Detections of a report, filtered by ?start=&end= (seconds) and ?class= (repeatable), paged by ?offset=&limit=."""
+    try:
+        report = report_io.read_report(report_io.report_path(UPLOAD_FOLDER, os.path.basename(video_id)))
+    except Exception:
+        return jsonify({'ok': False, 'error': 'report not found'}), 404
+    try:
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(0, int(request.args.get('limit', DETECTIONS_PAGE_SIZE))), DETECTIONS_PAGE_MAX)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'bad offset or limit'}), 400
+    cols = load_detection_columns(video_id, report)
+    if cols is None:
+        return jsonify({'ok': True, 'total': 0, 'offset': offset, 'limit': limit, 'detections': []})
+    dets, total = page_detections(cols, _best_thumbnail(report), start, end, request.args.getlist('class'), offset, limit)
+    return jsonify({'ok': True, 'total': total, 'offset': offset, 'limit': limit, 'detections': dets})
+
+
+@app.route('/view/<video_id>')
+def view_video(video_id):
+    report = None
+    report_path = report_io.report_path(UPLOAD_FOLDER, os.path.basename(video_id))
+    try:
+        report = report_io.read_report(report_path)
+    except Exception:
+        report = None
+    if not report:
         # If a background job exists for this id, show a waiting page that polls status
         j = JOBS.get(video_id)
         if j:
             return render_template_string(WAIT_HTML, job_id=video_id)
         return 'Report not found', 404
-    dets = report.get('detections', [])
     segments = report.get('segments', [])
-    best = report.get('best_thumbnail','')
-    if best:
-        best = os.path.basename(best).replace('\\','/')
-    for d in dets:
-        t = d.get('thumbnail','') or ''
-        d['thumbnail'] = t.replace('\\','/').lstrip('/') if t else best
+    video_file = f"{video_id}.mp4"
+    # ?gap=N re-merges the detections with another gap, for this view only
+    stored_gap = report.get('merge_gap', MERGE_GAP)
+    try:
+        gap = max(0.0, float(request.args.get('gap', stored_gap)))
+    except ValueError:
+        gap = stored_gap
+    if gap != stored_gap:
+        cols = load_detection_columns(video_id, report)
+        if cols is not None and len(cols['timestamp']):
+            thumbs, fi = cols['thumbnails'], cols['frame_index']
+            segments = segment_merge.merge_table(cols['timestamp'], cols['class_id'], cols['classes'].tolist(), cols['score'],
+                                                 cols['body_type_id'], cols['body_types'].tolist(),
+                                                 lambda i: str(thumbs[cols['thumb_id'][i]]),
+                                                 lambda i: int(fi[i]) if fi[i] >= 0 else None, gap)
+    # segments left 'pending' (BODY_TYPE_MODE 'view', triage) are classified by a scan worker,
+    # which saves them in the report; the page shows them as pending until then
+    if any(sg.get('body_type') == 'pending' for sg in report.get('segments', [])):
+        queue_classify(video_id)
+    best = _best_thumbnail(report)
+    # segment cards show their tile of the sprite sheet (background-position in %)
+    sprite = report.get('sprite') or {}
+    tiles = {t: i for i, t in enumerate(sprite.get('tiles') or [])}
+    cols, rows = max(1, sprite.get('columns') or 1), max(1, sprite.get('rows') or 1)
     for s in segments:
         t = s.get('thumbnail','') or ''
         s['thumbnail'] = t.replace('\\','/').lstrip('/') if t else best
-    video_file = f"{video_id}.mp4"
-    return render_template_string(RESULT_HTML, results=dets, segments=segments, duration=report.get('duration',0.0), video_file=video_file, video_name=report.get('video',''))
+        # time of the segment's best frame (its sprite tile), for the timeline preview
+        if s.get('frame_index') is not None and report.get('fps'):
+            s['best_ts'] = s['frame_index'] / float(report['fps'])
+        if s['thumbnail'] in tiles:
+            r, c = divmod(tiles[s['thumbnail']], cols)
+            s['sprite_pos'] = f"{c * 100.0 / max(1, cols - 1):.4g}% {r * 100.0 / max(1, rows - 1):.4g}%"
+    # the detection list is only shown when there are no segments; give it the first page
+    dets, total = [], report.get('detection_count', len(report.get('detections', [])))
+    if not segments and total:
+        cols = load_detection_columns(video_id, report)
+        if cols is not None:
+            dets, total = page_detections(cols, best)
+    return render_template_string(RESULT_HTML, results=dets, detection_count=total, segments=segments, duration=report.get('duration',0.0), video_file=video_file, video_name=report.get('video',''),
+                                  partial=report.get('partial', False), sprite_file=sprite.get('file', ''), sprite_size=f"{cols * 100}% {rows * 100}%",
+                                  heatmap_file=report.get('heatmap_file', ''))
+
+
+def find_videos(paths, list_file=None):
+    """Video files under `paths` (files or directory trees) and in `list_file` (one per line, '-' for stdin)."""
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs[:] = sorted(d for d in dirs if d != SIDECAR_DIR)
+                found += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(VIDEO_EXTENSIONS)]
+        elif os.path.isfile(p):
+            found.append(p)
+        else:
+            print(f'not found: {p}', file=sys.stderr)
+    if list_file:
+        fh = sys.stdin if list_file == '-' else open(list_file, 'r', encoding='utf-8')
+        try:
+            found += [line.strip() for line in fh if line.strip()]
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+    seen = set()
+    return [p for p in (os.path.abspath(f) for f in found) if not (p in seen or seen.add(p))]
+
+
+def batch_target(video_path, to_store):
+    """(video_id, out_dir) for a video scanned from the command line.
+
+    Into the store the id is derived from the absolute path so reruns find earlier reports;
+    beside the video it is the file name, in the SIDECAR_DIR next to it.
+    """
+    if to_store:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, 'file://' + video_path)), UPLOAD_FOLDER
+    return os.path.basename(video_path), os.path.join(os.path.dirname(video_path), SIDECAR_DIR)
+
+
+def _link_into_store(video_path, video_id):
+    """Make the video playable from /view without copying it when the filesystem allows."""
+    dest = os.path.join(UPLOAD_FOLDER, f"{video_id}.mp4")
+    if os.path.exists(dest):
+        return
+    for link in (os.link, os.symlink):
+        try:
+            link(video_path, dest)
+            return
+        except Exception:
+            continue
+    shutil.copyfile(video_path, dest)
+
+
+def _batch_scan_one(video_path, options, to_store):
+    video_id, out_dir = batch_target(video_path, to_store)
+    os.makedirs(os.path.join(out_dir, 'thumbs'), exist_ok=True)
+    options = dict(options)
+    if to_store:
+        _link_into_store(video_path, video_id)
+        options['sha256'] = _file_sha256(video_path)
+    stats = process_video_job(video_id, os.path.basename(video_path), video_path, video_id, options, out_dir, to_store)
+    job = JOBS.get(video_id) or {}
+    if to_store and job.get('state') == 'done':
+        record_content_hash(options['sha256'], video_id)
+    return video_path, job.get('state'), job.get('error'), stats
+
+
+def _set_scan_processes(n):
+    global _scan_processes
+    _scan_processes = n
+
+
+def batch_scan(args):
+    """`scan` command: scan many videos without the web app and print a throughput summary."""
+    options, error = scan_options_from_form({'sampling': args.sampling, 'scan': args.scan, 'triage_score': args.triage_score})
+    if error:
+        print(error, file=sys.stderr)
+        return 2
+    videos = find_videos(args.paths, args.list)
+    todo = []
+    skipped = 0
+    for v in videos:
+        video_id, out_dir = batch_target(v, args.store)
+        if not args.rescan and os.path.exists(report_io.report_path(out_dir, video_id)):
+            skipped += 1
+        else:
+            todo.append(v)
+    print(f'{len(videos)} videos, {skipped} already scanned, {len(todo)} to scan', file=sys.stderr)
+
+    totals = ScanStats()
+    failed = []
+    start = time.time()
+    jobs = max(1, int(args.jobs))
+    pool = None
+    futures = {}
+    _set_scan_processes(jobs)
+    if jobs > 1:
+        # one process per concurrent video, like the server's process engine
+        pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_set_scan_processes, initargs=(jobs,))
+    try:
+        if pool is None:
+            results = (_batch_scan_one(v, options, args.store) for v in todo)
+        else:
+            futures = {pool.submit(_batch_scan_one, v, options, args.store): v for v in todo}
+
+            def collect():
+                for f in as_completed(futures):
+                    try:
+                        yield f.result()
+                    except Exception as e:
+                        # e.g. a worker process crashed on this video
+                        yield futures[f], 'error', str(e) or type(e).__name__, None
+            results = collect()
+        for n, (video_path, state, err, stats) in enumerate(results, 1):
+            totals.merge(stats)
+            c = (stats or {}).get('counters', {})
+            if state != 'done':
+                failed.append((video_path, err))
+            print(f'[{n}/{len(todo)}] {video_path}: {state or "error"}'
+                  + (f' ({err})' if err else f' in {c.get("scan_seconds", 0):.1f}s, {c.get("frames_hit", 0)} frames flagged'), file=sys.stderr)
+    except KeyboardInterrupt:
+        # unfinished videos have no report and are picked up by the next run, from their checkpoint
+        print('interrupted', file=sys.stderr)
+        for f in futures:
+            f.cancel()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    wall = max(1e-6, time.time() - start)
+    c = totals.to_dict()['counters']
+    summary = {
+        'videos': len(videos), 'skipped': skipped, 'scanned': int(c.get('jobs_done', 0)), 'failed': len(failed),
+        'wall_seconds': round(wall, 2),
+        'video_seconds': round(c.get('video_seconds', 0.0), 2),
+        'realtime_factor': round(c.get('video_seconds', 0.0) / wall, 2),
+        'videos_per_hour': round(c.get('jobs_done', 0) * 3600.0 / wall, 1),
+        'frames_sampled': int(c.get('frames_sampled', 0)),
+        'sampled_fps': round(c.get('frames_sampled', 0) / wall, 2),
+        'frames_flagged': int(c.get('frames_hit', 0)),
+    }
+    print(json.dumps(summary, indent=2))
+    for video_path, err in failed:
+        print(f'failed: {video_path}: {err}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan videos for NSFW content.')
+    sub = parser.add_subparsers(dest='command')
+    serve = sub.add_parser('serve', help='run the web app (default)')
+    serve.add_argument('--host', default=SERVE_HOST)
+    serve.add_argument('--port', type=int, default=SERVE_PORT)
+    serve.add_argument('--production', action='store_true', help='serve with waitress (threaded) instead of the debug server')
+    serve.add_argument('--threads', type=int, default=SERVE_THREADS, help='request threads in production mode')
+    scan = sub.add_parser('scan', help='scan files or directory trees without the web app')
+    scan.add_argument('paths', nargs='*', help='video files or directories (searched recursively)')
+    scan.add_argument('--list', metavar='FILE', help="file with one video path per line ('-' for stdin)")
+    scan.add_argument('-j', '--jobs', type=int, default=SCAN_WORKERS, help='videos scanned at the same time')
+    scan.add_argument('--store', action='store_true', help=f'add reports to the web app library instead of writing them to {SIDECAR_DIR}/ next to each video')
+    scan.add_argument('--rescan', action='store_true', help='scan videos that already have a report')
+    scan.add_argument('--sampling', choices=SAMPLING_MODES, help='frame sampling mode')
+    scan.add_argument('--scan', choices=SCAN_MODES, help='full, adaptive or triage scan')
+    scan.add_argument('--triage-score', type=float, help=f'score that ends a triage scan (default {TRIAGE_MIN_SCORE})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'scan':
+        return batch_scan(args)
+    if args.command is None:
+        args = parser.parse_args(['serve'])
+    return run_server(args)
+
+
+def run_server(args):
+    """`serve` command: run the web app and the scan scheduler."""
+    if not args.production:
+        # the debug reloader imports this module twice; only the serving child runs scans
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_scheduler()
+        app.run(host=args.host, port=args.port, debug=True)
+        return 0
+    global _push_limit
+    _push_limit = max(1, int(args.threads) // 2)
+    start_scheduler()
+    if waitress is None:
+        print('waitress is not installed; using the threaded Werkzeug server', file=sys.stderr)
+        app.run(host=args.host, port=args.port, debug=False, threaded=True, use_reloader=False)
+        return 0
+    waitress.serve(app, host=args.host, port=args.port, threads=max(1, int(args.threads)))
+    return 0
 
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=5000, debug=True)
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Reading and writing scan reports, shared by NudeID.py and the scripts.
+
+A report is `<id>_report.json`, a small JSON header (summary, segments, settings), plus
+`<id>_detections.npz` holding the per-frame detections as NumPy columns. The header is enough
+for the library and the viewer; the detections are only loaded when something asks for them.
+Reports written before this format keep their detections inline in the JSON and are read the
+same way, and get converted the next time they are written.
+"""
+import json
+import os
+
+import numpy as np
+
+REPORT_FORMAT = 2
+REPORT_SUFFIX = '_report.json'
+DETECTIONS_SUFFIX = '_detections.npz'
+
+# Box columns are padded to this width; `box_len` keeps each box's real length
+BOX_WIDTH = 4
+
+
+def report_path(out_dir, video_id):
+    return os.path.join(out_dir, f"{video_id}{REPORT_SUFFIX}")
+
+
+def detections_path(path):
+    """The detections file that belongs to the report header at `path`."""
+    base = path[:-len(REPORT_SUFFIX)] if path.endswith(REPORT_SUFFIX) else os.path.splitext(path)[0]
+    return base + DETECTIONS_SUFFIX
+
+
+def _table(values):
+    """Integer ids for `values` in order of first appearance, and the distinct values as a str array."""
+    index = {}
+    ids = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    return ids, np.array(list(index), dtype=str) if index else np.zeros(0, dtype='U1')
+
+
+def to_columns(detections):
+    """Detection dicts -> dict of NumPy columns (the layout stored in the .npz)."""
+    n = len(detections)
+    class_id, classes = _table([str(d.get('class') or 'unknown') for d in detections])
+    body_type_id, body_types = _table([str(d.get('body_type') or 'unknown') for d in detections])
+    thumb_id, thumbnails = _table([str(d.get('thumbnail') or '') for d in detections])
+    boxes = [list(d.get('box') or [])[:BOX_WIDTH] for d in detections]
+    box = np.zeros((n, BOX_WIDTH), dtype=np.float64)
+    for i, b in enumerate(boxes):
+        box[i, :len(b)] = b
+    # NudeNet boxes are pixel ints; keep them ints so they come back as such
+    if np.all(box == np.round(box)):
+        box = box.astype(np.int64)
+    frame_index = [d.get('frame_index') for d in detections]
+    return {
+        'timestamp': np.array([float(d.get('timestamp', 0.0)) for d in detections], dtype=np.float64),
+        'frame_index': np.array([-1 if f is None else int(f) for f in frame_index], dtype=np.int64),
+        'score': np.array([float(d.get('score', 0.0)) for d in detections], dtype=np.float64),
+        'box': box,
+        'box_len': np.array([len(b) for b in boxes], dtype=np.int8),
+        'class_id': class_id, 'classes': classes,
+        'body_type_id': body_type_id, 'body_types': body_types,
+        'thumb_id': thumb_id, 'thumbnails': thumbnails,
+    }
+
+
+def from_columns(cols, rows=None):
+    """Dict of columns -> detection dicts, for all rows or the given row indices."""
+    rows = np.arange(len(cols['timestamp'])) if rows is None else np.asarray(rows, dtype=np.int64)
+    classes, body_types, thumbnails = cols['classes'].tolist(), cols['body_types'].tolist(), cols['thumbnails'].tolist()
+    ts, fi, sc = cols['timestamp'][rows].tolist(), cols['frame_index'][rows].tolist(), cols['score'][rows].tolist()
+    box, box_len = cols['box'][rows].tolist(), cols['box_len'][rows].tolist()
+    cid, bid, tid = cols['class_id'][rows].tolist(), cols['body_type_id'][rows].tolist(), cols['thumb_id'][rows].tolist()
+    out = []
+    for k in range(len(ts)):
+        d = {'timestamp': ts[k]}
+        if fi[k] >= 0:
+            d['frame_index'] = fi[k]
+        d.update({'class': classes[cid[k]], 'score': sc[k], 'box': box[k][:box_len[k]],
+                  'body_type': body_types[bid[k]], 'thumbnail': thumbnails[tid[k]]})
+        out.append(d)
+    return out
+
+
+def select(cols, start=None, end=None, classes=None):
+    """Row indices with start <= timestamp < end and class in `classes`, in stored order."""
+    mask = np.ones(len(cols['timestamp']), dtype=bool)
+    if start is not None:
+        mask &= cols['timestamp'] >= float(start)
+    if end is not None:
+        mask &= cols['timestamp'] < float(end)
+    if classes:
+        classes = set(classes)
+        wanted = [i for i, c in enumerate(cols['classes'].tolist()) if c in classes]
+        mask &= np.isin(cols['class_id'], wanted)
+    return np.flatnonzero(mask)
+
+
+def summarize(cols):
+    """Header fields describing the detections: count, per-class counts (first seen first), first hit."""
+    counts = np.bincount(cols['class_id'], minlength=len(cols['classes'])).tolist()
+    return {
+        'detection_count': int(len(cols['timestamp'])),
+        'detection_classes': dict(zip(cols['classes'].tolist(), counts)),
+        'first_detection': float(cols['timestamp'][0]) if len(cols['timestamp']) else None,
+    }
+
+
+def read_report(path, detections=False):
+    """Load the report header at `path`; with `detections` also the detection dicts (old or new format)."""
+    with open(path, 'r', encoding='utf-8') as fh:
+        report = json.load(fh)
+    if detections and 'detections' not in report:
+        cols = read_columns(path, report)
+        report['detections'] = from_columns(cols) if cols is not None else []
+    return report
+
+
+def read_columns(path, report=None):
+    """The detection columns of the report at `path` (its header may be passed in), or None."""
+    if report is None:
+        with open(path, 'r', encoding='utf-8') as fh:
+            report = json.load(fh)
+    if 'detections' in report:
+        return to_columns(report.get('detections') or [])
+    name = report.get('detections_file')
+    if not name:
+        return None
+    with np.load(os.path.join(os.path.dirname(path), os.path.basename(name)), allow_pickle=False) as z:
+        return {k: z[k] for k in z.files}
+
+
+def write_report(path, report, columns=None):
+    """Write `report` as a header plus detections file.
+
+    Detections come from `columns` or from the report's 'detections' list, which is left out of
+    the header. The detections file goes first, so an existing header always means a finished
+    report.
+    """
+    header = {k: v for k, v in report.items() if k != 'detections'}
+    if columns is None and 'detections' in report:
+        columns = to_columns(report.get('detections') or [])
+    if columns is not None:
+        det_path = detections_path(path)
+        tmp = det_path + '.tmp.npz'
+        np.savez_compressed(tmp, **columns)
+        os.replace(tmp, det_path)
+        header.update(summarize(columns))
+        header['detections_file'] = os.path.basename(det_path)
+    header['format'] = REPORT_FORMAT
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(header, fh, indent=2)
+    os.replace(tmp, path)
+    return header
@@ -33,7 +33,7 @@ if exist requirements.txt (
 
 REM Start server in a new window so console output stays visible
 echo Starting server in a new window...
-start "Moderator Server" cmd /k ".venv\Scripts\python.exe NudeID.py"
+start "Moderator Server" cmd /k ".venv\Scripts\python.exe NudeID.py serve --production"
 
 REM Give server a moment and open browser
 timeout /t 2 >nul
@@ -1,11 +1,14 @@
-import glob, json, os
+import glob, os, sys
 
-UPLOAD_FOLDER = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads'))
+ROOT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT_DIR)
+from report_io import read_report, write_report
+
+UPLOAD_FOLDER = os.path.join(ROOT_DIR, 'uploads')
 
 for p in glob.glob(os.path.join(UPLOAD_FOLDER, '*_report.json')):
     try:
-        with open(p, 'r', encoding='utf-8') as fh:
-            rep = json.load(fh)
+        rep = read_report(p, detections=True)
     except Exception as e:
         print('skip', p, e)
         continue
@@ -32,8 +35,7 @@ for p in glob.glob(os.path.join(UPLOAD_FOLDER, '*_report.json')):
                 changed = True
     if changed:
         try:
-            with open(p, 'w', encoding='utf-8') as fh:
-                json.dump(rep, fh, indent=2)
+            write_report(p, rep)
             print('aligned', p)
         except Exception as e:
             print('failed write', p, e)
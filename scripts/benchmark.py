@@ -0,0 +1,316 @@
+"""Offline benchmark for the scan pipeline, the segment merge and the library listing.
+
+Generates synthetic MP4s with OpenCV, scans them with a stub detector of fixed latency (no
+model, no GPU) and prints one JSON document with frames per second, per-stage latency and
+peak RSS. Every measurement runs in a fresh child process so peak RSS belongs to that phase.
+
+    python scripts/benchmark.py                      # default matrix
+    python scripts/benchmark.py --quick --out a.json
+    python scripts/benchmark.py --set SAMPLE_FPS=4 --set DETECT_MAX_WIDTH=800 --out b.json
+    python scripts/benchmark.py --compare a.json b.json
+"""
+import argparse, json, os, platform, subprocess, sys, tempfile, time
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# (width, height, fps, seconds)
+DEFAULT_VIDEOS = [(640, 360, 30, 30), (1280, 720, 30, 30), (1920, 1080, 25, 15), (854, 480, 60, 20)]
+QUICK_VIDEOS = [(640, 360, 30, 8), (1280, 720, 25, 6)]
+DEFAULT_MERGE_SIZES = [1000, 10000, 100000]
+DEFAULT_INDEX_SIZES = [100, 5000]
+
+# Seconds (mod 10) during which the synthetic video shows the marker the stub detector reports
+HIT_SECONDS = (2, 3, 7)
+MARKER = 48
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(rss / 1024) if sys.platform == 'darwin' else int(rss)
+
+
+def make_video(path, width, height, fps, seconds, seed=0):
+    """Moving shapes over noise, with a bright marker in the top-left corner during HIT_SECONDS."""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not out.isOpened():
+        raise RuntimeError('cannot write ' + path)
+    for i in range(int(fps * seconds)):
+        t = i / float(fps)
+        frame = noise.copy()
+        # slow drift so consecutive samples differ a little, with a scene cut every 5 seconds
+        frame[:] += np.uint8((int(t // 5) * 37) % 120)
+        cx = int((width / 2) + (width / 3) * np.sin(t))
+        cy = int((height / 2) + (height / 4) * np.cos(t * 0.7))
+        cv2.circle(frame, (cx, cy), max(8, height // 8), (40, 160, 220), -1)
+        cv2.rectangle(frame, (width // 10, height // 2), (width // 10 + width // 6, height // 2 + height // 5), (200, 80, 60), -1)
+        if int(t) % 10 in HIT_SECONDS:
+            frame[:MARKER, :MARKER] = (255, 255, 255)
+        out.write(frame)
+    out.release()
+
+
+class StubDetector:
+    """Stands in for NudeDetector: sleeps a fixed time per call and per image, flags the marker."""
+
+    def __init__(self, call_ms, frame_ms):
+        self.call_s = call_ms / 1000.0
+        self.frame_s = frame_ms / 1000.0
+
+    def _dets(self, img):
+        if float(img[:8, :8].mean()) < 200:
+            return []
+        h, w = img.shape[:2]
+        return [{'class': 'FEMALE_BREAST_EXPOSED', 'score': 0.8, 'box': [w // 4, h // 4, w // 4, h // 4]}]
+
+    def detect(self, img):
+        time.sleep(self.call_s + self.frame_s)
+        return self._dets(img)
+
+    def detect_batch(self, imgs, batch_size=4):
+        time.sleep(self.call_s + self.frame_s * len(imgs))
+        return [self._dets(i) for i in imgs]
+
+
+def load_app(work_dir, settings):
+    """Import NudeID with every on-disk path moved into `work_dir` and `settings` applied."""
+    sys.path.insert(0, ROOT)
+    import NudeID as N
+    N.UPLOAD_FOLDER = work_dir
+    os.makedirs(os.path.join(work_dir, 'thumbs'), exist_ok=True)
+    N.FRAME_CACHE_FILE = os.path.join(work_dir, 'frame_cache.db')
+    N.QUEUE_FILE = os.path.join(work_dir, 'queue.json')
+    N.LIBRARY_DB = os.path.join(work_dir, 'library.db')
+    N.HASH_INDEX_FILE = os.path.join(work_dir, 'hash_index.db')
+    for k, v in settings.items():
+        setattr(N, k, v)
+    return N
+
+
+def stage_summary(profile):
+    out = {}
+    for name, st in (profile.get('stages') or {}).items():
+        out[name] = {'count': st['count'], 'total_s': round(st['sum'], 6), 'mean_ms': round(st['mean'] * 1000, 4), 'max_ms': round(st['max'] * 1000, 4)}
+    return out
+
+
+def phase_scan(args, N):
+    N.detector = StubDetector(args.call_ms, args.frame_ms)
+    # extra pool instances (DETECTOR_POOL_SIZE > 1) are stubs too
+    N.DETECTOR_POOL.factory = lambda: StubDetector(args.call_ms, args.frame_ms)
+    if not args.person_model:
+        N.PERSON_MODEL = None
+    cap = cv2.VideoCapture(args.video)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+    runs = []
+    for i in range(args.repeat):
+        vid = f'bench{i}'
+        t0 = time.perf_counter()
+        profile = N.process_video_job(vid, os.path.basename(args.video), args.video, vid, {})
+        wall = time.perf_counter() - t0
+        job = N.JOBS.get(vid) or {}
+        if job.get('state') != 'done':
+            raise RuntimeError(job.get('error') or 'scan failed')
+        counters = profile.get('counters', {})
+        runs.append({'wall_s': round(wall, 4),
+                     'video_fps': round(frame_count / wall, 2),
+                     'sampled_fps': round(counters.get('frames_sampled', 0) / wall, 2),
+                     'counters': counters,
+                     'stages': stage_summary(profile)})
+    best = min(runs, key=lambda r: r['wall_s'])
+    return {'frames': frame_count, 'runs': runs, 'best': best}
+
+
+def phase_merge(args, N):
+    rng = np.random.default_rng(args.seed)
+    classes = ['FEMALE_BREAST_EXPOSED', 'FEMALE_GENITALIA_EXPOSED', 'BUTTOCKS_EXPOSED', 'MALE_GENITALIA_EXPOSED', 'ANUS_EXPOSED']
+    n = args.detections
+    ts = np.sort(rng.uniform(0, n / 4.0, size=n))
+    dets = [{'timestamp': float(t), 'frame_index': int(t * 30), 'class': classes[int(c)], 'score': float(s),
+             'box': [0, 0, 1, 1], 'body_type': 'unknown', 'thumbnail': f'thumbs/x_f{int(t * 30)}.jpg'}
+            for t, c, s in zip(ts, rng.integers(0, len(classes), size=n), rng.uniform(0.3, 1.0, size=n))]
+    times = []
+    segments = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        segments = N.merge_segments(dets)
+        times.append(time.perf_counter() - t0)
+    return {'detections': n, 'segments': len(segments), 'best_ms': round(min(times) * 1000, 4), 'mean_ms': round(sum(times) / len(times) * 1000, 4)}
+
+
+def phase_index(args, N):
+    for i in range(args.reports):
+        rep = {'video': f'video{i}.mp4', 'video_id': f'bench-{i:06d}', 'best_thumbnail': f'bench-{i:06d}_best.jpg', 'scan_time': 1.0,
+               'detections': [{'timestamp': 1.0, 'class': 'FEMALE_BREAST_EXPOSED'}] if i % 3 else [],
+               'segments': [{'start': 1.0}] if i % 3 else []}
+        # a real header on disk, or the library sync drops the row as orphaned
+        N.report_io.write_report(N.report_io.report_path(N.UPLOAD_FOLDER, rep['video_id']), rep)
+    client = N.app.test_client()
+    # the first request indexes the reports; only the listing itself is timed
+    client.get('/')
+    pages = max(1, -(-args.reports // N.PAGE_SIZE))
+    result = {'reports': args.reports}
+    for name, url in (('first_page', '/'), ('last_page', f'/?page={pages}')):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            r = client.get(url)
+            times.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                raise RuntimeError(f'{url} returned {r.status_code}')
+        result[name] = {'best_ms': round(min(times) * 1000, 4), 'mean_ms': round(sum(times) / len(times) * 1000, 4)}
+    total = N.list_reports()[1]
+    if total != args.reports:
+        raise RuntimeError(f'library holds {total} of {args.reports} reports')
+    return result
+
+
+def run_child(args):
+    settings = json.loads(args.settings or '{}')
+    with tempfile.TemporaryDirectory(prefix='nudeid-bench-') as work:
+        rss_start = peak_rss_kb()
+        N = load_app(work, settings)
+        rss_import = peak_rss_kb()
+        out = {'scan': phase_scan, 'merge': phase_merge, 'index': phase_index}[args.phase](args, N)
+        out['peak_rss_kb'] = peak_rss_kb()
+        out['rss_after_import_kb'] = rss_import
+        out['rss_at_start_kb'] = rss_start
+    json.dump(out, sys.stdout)
+
+
+def child(phase, args, **extra):
+    cmd = [sys.executable, os.path.abspath(__file__), '--phase', phase, '--repeat', str(args.repeat), '--seed', str(args.seed),
+           '--call-ms', str(args.call_ms), '--frame-ms', str(args.frame_ms), '--settings', json.dumps(args.settings)]
+    if args.person_model:
+        cmd.append('--person-model')
+    for k, v in extra.items():
+        cmd += ['--' + k.replace('_', '-'), str(v)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': (proc.stderr or '').strip().splitlines()[-1:] or ['failed']}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def parse_setting(text):
+    key, _, value = text.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key.strip(), value
+
+
+def compare(a_path, b_path):
+    """Print relative change of the headline numbers between two result files."""
+    with open(a_path, 'r', encoding='utf-8') as fh:
+        a = json.load(fh)
+    with open(b_path, 'r', encoding='utf-8') as fh:
+        b = json.load(fh)
+
+    def line(name, old, new, higher_is_better):
+        if not old or new is None:
+            return
+        change = (new - old) / old * 100.0
+        better = change > 0 if higher_is_better else change < 0
+        print(f'{name:<48} {old:>12.3f} {new:>12.3f} {change:+8.1f}% {"better" if better else "worse" if change else ""}')
+
+    for key, sa in a.get('scan', {}).items():
+        sb = b.get('scan', {}).get(key)
+        if not sb or 'best' not in sa or 'best' not in sb:
+            continue
+        line(f'scan {key} sampled fps', sa['best']['sampled_fps'], sb['best']['sampled_fps'], True)
+        line(f'scan {key} peak rss MB', (sa.get('peak_rss_kb') or 0) / 1024.0, (sb.get('peak_rss_kb') or 0) / 1024.0, False)
+        for stage, st in sa['best']['stages'].items():
+            other = sb['best']['stages'].get(stage)
+            if other:
+                line(f'  {stage} mean ms', st['mean_ms'], other['mean_ms'], False)
+    for key, ma in a.get('merge', {}).items():
+        mb = b.get('merge', {}).get(key)
+        if mb and 'best_ms' in ma and 'best_ms' in mb:
+            line(f'merge {key} ms', ma['best_ms'], mb['best_ms'], False)
+    for key, ia in a.get('index', {}).items():
+        ib = b.get('index', {}).get(key)
+        if ib and 'first_page' in ia and 'first_page' in ib:
+            line(f'index {key} first page ms', ia['first_page']['best_ms'], ib['first_page']['best_ms'], False)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--quick', action='store_true', help='small matrix for a fast smoke run')
+    ap.add_argument('--out', help='write the JSON result here instead of stdout')
+    ap.add_argument('--repeat', type=int, default=3, help='runs per measurement; the best one is reported')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--call-ms', type=float, default=5.0, help='stub detector latency per call')
+    ap.add_argument('--frame-ms', type=float, default=15.0, help='stub detector latency per image')
+    ap.add_argument('--person-model', action='store_true', help='keep YOLO for body type if installed (default: HOG)')
+    ap.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='override a NudeID setting, e.g. SAMPLE_FPS=4')
+    ap.add_argument('--video-dir', help='where to keep generated videos between runs (default: a temp dir)')
+    ap.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    # internal: one measurement in a child process
+    ap.add_argument('--phase', choices=['scan', 'merge', 'index'], help=argparse.SUPPRESS)
+    ap.add_argument('--video', help=argparse.SUPPRESS)
+    ap.add_argument('--detections', type=int, help=argparse.SUPPRESS)
+    ap.add_argument('--reports', type=int, help=argparse.SUPPRESS)
+    ap.add_argument('--settings', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.phase:
+        run_child(args)
+        return
+
+    args.settings = dict(parse_setting(s) for s in args.set)
+    # repeated runs must not be answered from the frame cache of the previous one
+    args.settings.setdefault('FRAME_CACHE_MAX_ENTRIES', 0)
+    videos = QUICK_VIDEOS if args.quick else DEFAULT_VIDEOS
+    merge_sizes = DEFAULT_MERGE_SIZES[:2] if args.quick else DEFAULT_MERGE_SIZES
+    index_sizes = DEFAULT_INDEX_SIZES[:1] if args.quick else DEFAULT_INDEX_SIZES
+
+    result = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                    'opencv': cv2.__version__, 'numpy': np.__version__},
+        'params': {'repeat': args.repeat, 'seed': args.seed, 'call_ms': args.call_ms, 'frame_ms': args.frame_ms,
+                   'settings': args.settings, 'person_model': args.person_model},
+        'scan': {}, 'merge': {}, 'index': {},
+    }
+    video_dir = args.video_dir or tempfile.mkdtemp(prefix='nudeid-bench-videos-')
+    os.makedirs(video_dir, exist_ok=True)
+    for w, h, fps, secs in videos:
+        key = f'{w}x{h}@{fps}x{secs}s'
+        path = os.path.join(video_dir, f'bench_{key}_seed{args.seed}.mp4')
+        if not os.path.exists(path):
+            make_video(path, w, h, fps, secs, args.seed)
+        print('scan', key, file=sys.stderr)
+        result['scan'][key] = child('scan', args, video=path)
+    for n in merge_sizes:
+        print('merge', n, file=sys.stderr)
+        result['merge'][str(n)] = child('merge', args, detections=n)
+    for n in index_sizes:
+        print('index', n, file=sys.stderr)
+        result['index'][str(n)] = child('index', args, reports=n)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
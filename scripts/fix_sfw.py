@@ -13,7 +13,8 @@ for p in glob.glob(os.path.join(UPLOAD_FOLDER, '*_report.json')):
     except Exception as e:
         print('skip read', p, e)
         continue
-    if rep.get('detections') == [] and not rep.get('best_thumbnail'):
+    # old reports keep detections inline, newer ones only their count in the header
+    if (rep.get('detections') == [] or rep.get('detection_count') == 0) and not rep.get('best_thumbnail'):
         vid = rep.get('video_id') + '.mp4'
         vp = os.path.join(UPLOAD_FOLDER, vid)
         if not os.path.exists(vp):
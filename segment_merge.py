@@ -0,0 +1,97 @@
+"""Merging per-frame detections into segments, shared by NudeID.py and the scripts.
+
+Detections of one class that are at most `gap` seconds apart form a segment. The merge works on
+columns (timestamps, class ids, scores, body type ids) with NumPy, so re-merging a long video
+with another gap costs a sort and a few array passes instead of a dict loop per detection.
+"""
+import numpy as np
+
+MERGE_GAP = 10.0
+
+
+def _ids(values):
+    """Integer ids for `values` in order of first appearance, and the distinct values."""
+    index = {}
+    ids = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64, count=len(values))
+    return ids, list(index)
+
+
+def merge_columns(timestamps, class_ids, scores, body_type_ids, gap=MERGE_GAP):
+    """Merge columnar detections; returns one array per segment field.
+
+    Segments come out grouped by class id, then in time order. For each segment: `class_id`,
+    `best` (row of its highest score, the first one on ties, by time), `end` (last timestamp),
+    `count`, `score` (max) and `body_type_id` (most frequent, the earliest on ties).
+    """
+    ts = np.asarray(timestamps, dtype=np.float64)
+    cid = np.asarray(class_ids, dtype=np.int64)
+    sc = np.asarray(scores, dtype=np.float64)
+    bt = np.asarray(body_type_ids, dtype=np.int64)
+    n = len(ts)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return {'class_id': empty, 'best': empty, 'end': np.zeros(0), 'count': empty, 'score': np.zeros(0), 'body_type_id': empty}
+
+    # by class, then by time; lexsort is stable so equal times keep their input order
+    order = np.lexsort((ts, cid))
+    t, c, s, b = ts[order], cid[order], sc[order], bt[order]
+    new = np.ones(n, dtype=bool)
+    new[1:] = (c[1:] != c[:-1]) | (t[1:] > t[:-1] + gap)
+    starts = np.flatnonzero(new)
+    seg = np.cumsum(new) - 1
+    ends = np.append(starts[1:], n)
+
+    best_score = np.maximum.reduceat(s, starts)
+    pos = np.arange(n)
+    best = np.minimum.reduceat(np.where(s == best_score[seg], pos, n), starts)
+
+    # most frequent body type per segment, ties going to the one seen first
+    nbt = int(b.max()) + 1
+    keys, first, counts = np.unique(seg * nbt + b, return_index=True, return_counts=True)
+    pick = np.lexsort((first, -counts, keys // nbt))
+    pair_seg = (keys // nbt)[pick]
+    lead = np.ones(len(pick), dtype=bool)
+    lead[1:] = pair_seg[1:] != pair_seg[:-1]
+    body = (keys % nbt)[pick][lead]
+
+    return {'class_id': c[starts], 'best': order[best], 'end': t[ends - 1], 'count': ends - starts, 'score': best_score, 'body_type_id': body}
+
+
+def _thumb(path):
+    path = path or ''
+    return path.replace('\\', '/').lstrip('/') if path else ''
+
+
+def merge_table(timestamps, class_ids, classes, scores, body_type_ids, body_types, thumbnail, frame_index, gap=MERGE_GAP):
+    """Merge columnar detections into segment dicts.
+
+    `classes` and `body_types` name the ids; `thumbnail(row)` and `frame_index(row)` give those
+    fields for the best row of each segment, so callers holding columns never build detection dicts.
+    """
+    ts = np.asarray(timestamps, dtype=np.float64)
+    cols = merge_columns(ts, class_ids, scores, body_type_ids, float(gap))
+    segments = []
+    for k in range(len(cols['best'])):
+        best = int(cols['best'][k])
+        segments.append({
+            'class': classes[int(cols['class_id'][k])],
+            'start': float(ts[best]),
+            'end': float(cols['end'][k]),
+            'score': float(cols['score'][k]),
+            'thumbnail': _thumb(thumbnail(best)),
+            'body_type': body_types[int(cols['body_type_id'][k])],
+            'count': int(cols['count'][k]),
+            'frame_index': frame_index(best),
+        })
+    return segments
+
+
+def merge_segments(detections, gap=MERGE_GAP):
+    """Merge detection dicts (timestamp, class, score, body_type, thumbnail, frame_index) into segment dicts."""
+    if not detections:
+        return []
+    class_ids, classes = _ids([d.get('class', 'unknown') for d in detections])
+    body_ids, body_types = _ids([d.get('body_type', 'unknown') for d in detections])
+    return merge_table([d.get('timestamp', 0.0) for d in detections], class_ids, classes,
+                       [d.get('score', 0.0) for d in detections], body_ids, body_types,
+                       lambda i: detections[i].get('thumbnail', ''), lambda i: detections[i].get('frame_index'), gap)
@@ -4,22 +4,25 @@ const fileInput = document.getElementById('fileInput');
 const uploadBtn = document.getElementById('uploadBtn');
 
 function prevent(e){e.preventDefault(); e.stopPropagation();}
-['dragenter','dragover','dragleave','drop'].forEach(ev => {
-  uploader.addEventListener(ev, prevent, false);
-});
-['dragenter','dragover'].forEach(ev => {
-  uploader.addEventListener(ev, ()=>uploader.classList.add('dragover'));
-});
-['dragleave','drop'].forEach(ev => {
-  uploader.addEventListener(ev, ()=>uploader.classList.remove('dragover'));
-});
+// the uploader only exists on the index page; app.js is loaded by the viewer too
+if(uploader){
+  ['dragenter','dragover','dragleave','drop'].forEach(ev => {
+    uploader.addEventListener(ev, prevent, false);
+  });
+  ['dragenter','dragover'].forEach(ev => {
+    uploader.addEventListener(ev, ()=>uploader.classList.add('dragover'));
+  });
+  ['dragleave','drop'].forEach(ev => {
+    uploader.addEventListener(ev, ()=>uploader.classList.remove('dragover'));
+  });
 
-uploader.addEventListener('drop', (e)=>{
-  const dt = e.dataTransfer; const files = dt.files; if(files.length) uploadFile(files[0]);
-});
+  uploader.addEventListener('drop', (e)=>{
+    const dt = e.dataTransfer; const files = dt.files; if(files.length) uploadFile(files[0]);
+  });
 
-uploadBtn.addEventListener('click', ()=>fileInput.click());
-fileInput.addEventListener('change', ()=>{ if(fileInput.files.length) uploadFile(fileInput.files[0]) });
+  uploadBtn.addEventListener('click', ()=>fileInput.click());
+  fileInput.addEventListener('change', ()=>{ if(fileInput.files.length) uploadFile(fileInput.files[0]) });
+}
 
 function toast(msg, timeout=2600){
   const t = document.createElement('div'); t.className='toast fade-in'; t.textContent = msg;
@@ -27,8 +30,66 @@ function toast(msg, timeout=2600){
   setTimeout(()=>{ t.style.opacity=0; setTimeout(()=>t.remove(),300); }, timeout);
 }
 
+// large files go up in resumable chunks so the server can start scanning before they finish
+const CHUNKED_UPLOAD_MIN = 32 * 1024 * 1024;
+const UPLOAD_CHUNK = 8 * 1024 * 1024;
+
+function scanOptions(form){
+  document.querySelectorAll('.scan-option').forEach(el=>{ if(el.name && el.value && !el.hidden) form.append(el.name, el.value); });
+  return form;
+}
+
+// the triage score box only shows (and is only sent) for triage scans
+const scanSelect = document.querySelector('select[name="scan"]');
+const triageScore = document.querySelector('input[name="triage_score"]');
+if(scanSelect && triageScore){
+  const syncTriage = ()=>{ triageScore.hidden = scanSelect.value !== 'triage'; };
+  scanSelect.addEventListener('change', syncTriage);
+  syncTriage();
+}
+
+async function uploadChunked(file){
+  const progress = document.querySelector('.progress i');
+  const start = scanOptions(new FormData());
+  start.append('filename', file.name); start.append('size', file.size);
+  let r = await fetch('/upload/start', {method:'POST', body:start});
+  const s = await r.json();
+  if(!s.ok) throw new Error(s.error || 'upload failed');
+  const id = s.upload_id;
+  let offset = 0, retries = 0;
+  while(offset < file.size){
+    try{
+      r = await fetch(`/upload/${id}?offset=${offset}`, {method:'PUT', body:file.slice(offset, offset + UPLOAD_CHUNK)});
+      const j = await r.json();
+      if(r.status === 409 && typeof j.received === 'number'){ offset = j.received; continue; }
+      if(!j.ok) throw new Error(j.error || 'chunk failed');
+      offset = j.received; retries = 0;
+    }catch(e){
+      // network hiccup: ask the server how far it got and carry on from there
+      if(++retries > 5) throw e;
+      await new Promise(res=>setTimeout(res, 1000 * retries));
+      try{ const st = await (await fetch(`/upload/${id}`)).json(); if(st.ok) offset = st.received; }catch(_){}
+    }
+    if(progress) progress.style.width = Math.round(offset / file.size * 100) + '%';
+  }
+  uploader.classList.add('processing');
+  r = await fetch(`/upload/${id}/finish`, {method:'POST'});
+  return r.json();
+}
+
 function uploadFile(file){
+  if(file.size >= CHUNKED_UPLOAD_MIN && window.fetch){
+    toast('Uploading...');
+    uploadChunked(file).then(j=>{
+      uploader.classList.remove('processing');
+      if(j && j.ok && j.view){ window.location.href = j.view; return; }
+      toast('Upload failed',3000);
+    }).catch(()=>{ uploader.classList.remove('processing'); toast('Upload failed',3000); });
+    return;
+  }
   const form = new FormData(); form.append('video', file);
+  // per-job scan options chosen next to the upload button
+  scanOptions(form);
   const xhr = new XMLHttpRequest();
   const progress = document.querySelector('.progress i');
   xhr.open('POST', '/', true);
@@ -133,6 +194,51 @@ document.addEventListener('click', (e)=>{
   }
 });
 
+// Viewer timeline: per-second score heatmap, click to seek, hover previews the segment there
+function initTimeline(){
+  const tl = document.getElementById('timeline');
+  const video = document.getElementById('player');
+  if(!tl || !video) return;
+  const canvas = tl.querySelector('canvas'), preview = tl.querySelector('.timeline-preview'), playhead = tl.querySelector('.playhead');
+  const duration = parseFloat(tl.dataset.duration || 0);
+  // matched on the segment's own start/end; the best frame only decides between overlapping ones
+  const segs = Array.from(document.querySelectorAll('.segments li[data-end]')).map(li=>{
+    const start = parseFloat(li.dataset.start || li.dataset.ts || 0), end = parseFloat(li.dataset.end || 0);
+    return {start, end, best: li.dataset.best !== undefined ? parseFloat(li.dataset.best) : (start + end) / 2, tile: li.querySelector('.seg-thumb.sprite')};
+  }).filter(s=>s.tile);
+  const segmentAt = t=>{
+    // distance from t to the segment (0 inside it), then from t to its best frame
+    const gap = s=>Math.max(0, s.start - t, t - s.end);
+    let found = null;
+    segs.forEach(s=>{
+      if(gap(s) > 1) return;
+      if(!found || gap(s) < gap(found) || (gap(s) === gap(found) && Math.abs(s.best - t) < Math.abs(found.best - t))) found = s;
+    });
+    return found;
+  };
+  fetch(tl.dataset.heatmap).then(r=>r.json()).then(h=>{
+    const scores = h.scores || [];
+    canvas.width = Math.max(1, scores.length); canvas.height = 1;
+    const ctx = canvas.getContext('2d'), img = ctx.createImageData(canvas.width, 1);
+    // transparent where nothing was found, yellow to red as the score rises
+    scores.forEach((v,i)=>{ if(v > 0) img.data.set([255, Math.round(220 - 2 * v), 60, 90 + Math.round(1.65 * v)], i * 4); });
+    ctx.putImageData(img, 0, 0);
+  }).catch(()=>{ tl.hidden = true; });
+  const timeAt = e=>{ const r = tl.getBoundingClientRect(); return Math.min(1, Math.max(0, (e.clientX - r.left) / r.width)) * duration; };
+  tl.addEventListener('click', e=>{ video.currentTime = timeAt(e); video.play(); });
+  tl.addEventListener('mousemove', e=>{
+    const t = timeAt(e);
+    const seg = segmentAt(t);
+    if(!seg){ preview.hidden = true; return; }
+    preview.style.backgroundPosition = seg.tile.style.backgroundPosition;
+    preview.style.left = (e.clientX - tl.getBoundingClientRect().left) + 'px';
+    preview.hidden = false;
+  });
+  tl.addEventListener('mouseleave', ()=>{ preview.hidden = true; });
+  video.addEventListener('timeupdate', ()=>{ if(duration > 0) playhead.style.left = (video.currentTime / duration * 100) + '%'; });
+}
+window.addEventListener('load', initTimeline);
+
 // Lazy-load images with fade-in
 document.addEventListener('DOMContentLoaded', ()=>{
   document.querySelectorAll('.card img').forEach(img=>{
@@ -0,0 +1,45 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import NudeID as N
+
+
+class EnqueueKeepsPersistedQueue(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = {k: getattr(N, k) for k in ('QUEUE_FILE', 'SCAN_ENGINE', '_scheduler_started', '_scan_worker', 'start_model_loading')}
+        N.QUEUE_FILE = os.path.join(self.dir, 'queue.json')
+        N.SCAN_ENGINE = 'thread'
+        N._scheduler_started = False
+        # no workers: the queue is only inspected
+        N._scan_worker = lambda: None
+        N.start_model_loading = lambda: None
+        del N.SCAN_QUEUE[:]
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(N, k, v)
+        del N.SCAN_QUEUE[:]
+
+    def _video(self, name):
+        path = os.path.join(self.dir, name + '.mp4')
+        open(path, 'wb').close()
+        return path
+
+    def test_enqueue_before_scheduler_keeps_saved_jobs(self):
+        saved = [{'job_id': j, 'video_id': j, 'original': j, 'video_path': self._video(j), 'options': {}, 'state': 'queued'}
+                 for j in ('old1', 'old2')]
+        with open(N.QUEUE_FILE, 'w', encoding='utf-8') as fh:
+            json.dump(saved, fh)
+        N.enqueue_job('new', 'new.mp4', self._video('new'), 'new')
+        with open(N.QUEUE_FILE, 'r', encoding='utf-8') as fh:
+            ids = [e['job_id'] for e in json.load(fh)]
+        self.assertEqual(ids, ['old1', 'old2', 'new'])
+
+
+if __name__ == '__main__':
+    unittest.main()